@@ -0,0 +1,121 @@
+"""
+Scaling benchmark of the reconciliation pipeline on seeded synthetic datasets.
+
+For every dataset size, generates the three source files with utils.synthetic and records
+the wall time and the peak traced memory (tracemalloc) of each stage: the three loaders,
+update_allowance_backend_table, generate_payment_schedule_backend_table and both
+compare_backend_dfs calls. Results can be appended to a JSON lines file and compared
+with an earlier run to make regressions visible.
+
+Run from the repository root:
+
+    python -m benchmarks.pipeline --sizes 1000 10000 100000
+    python -m benchmarks.pipeline --sizes 1000 10000 --output bench.jsonl --baseline previous.jsonl
+"""
+import argparse
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+
+import pandas as pd
+
+from utils.compare import compare_backend_dfs
+from utils.load_n_transform import get_allowance_backend_table, get_payment_schedule_backend_table, get_allowance_events
+from utils.payment_schedule import update_allowance_backend_table, generate_payment_schedule_backend_table
+from utils.synthetic import write_synthetic_dataset
+
+
+def measure(stage: str, func, *args, **kwargs) -> tuple:
+    """
+    Run func once and return its result with the stage's wall time and peak traced memory.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        wall_s = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {'stage': stage, 'wall_s': wall_s, 'peak_mb': peak / 2**20}
+
+def run_pipeline(paths: dict) -> list:
+
+    records = []
+
+    allowance_backend_table, record = measure('load_allowance_backend_table', get_allowance_backend_table, paths['allowance_backend_table'])
+    records.append(record)
+    payment_schedule_backend_table, record = measure('load_payment_schedule_backend_table', get_payment_schedule_backend_table, paths['payment_schedule_backend_table'])
+    records.append(record)
+    allowance_events, record = measure('load_allowance_events', get_allowance_events, paths['allowance_events'])
+    records.append(record)
+
+    allowance_backend_df, record = measure('update_allowance_backend_table', update_allowance_backend_table, allowance_backend_table, allowance_events.copy())
+    records.append(record)
+    payment_schedule_df, record = measure('generate_payment_schedule_backend_table', generate_payment_schedule_backend_table, allowance_backend_df)
+    records.append(record)
+
+    _, record = measure(
+        'compare_allowance_backend_table', compare_backend_dfs,
+        allowance_backend_df.set_index('uuid'), allowance_backend_table.set_index('uuid')
+    )
+    records.append(record)
+    _, record = measure(
+        'compare_payment_schedule_backend_table', compare_backend_dfs,
+        payment_schedule_df.set_index('uuid'), payment_schedule_backend_table.set_index('uuid')
+    )
+    records.append(record)
+
+    return records
+
+def benchmark(sizes: list, seed=0) -> pd.DataFrame:
+
+    results = []
+    for n_users in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = write_synthetic_dataset(tmp_dir, n_users, seed=seed)
+            for record in run_pipeline(paths):
+                results.append({'n_users': n_users, **record})
+
+    return pd.DataFrame(results)
+
+def compare_with_baseline(results: pd.DataFrame, baseline_path: str) -> pd.DataFrame:
+    """
+    Add wall time and peak memory ratios against the latest baseline run of each (n_users, stage).
+    """
+    baseline = pd.read_json(baseline_path, lines=True)
+    baseline = baseline.drop_duplicates(['n_users', 'stage'], keep='last')[['n_users', 'stage', 'wall_s', 'peak_mb']]
+
+    merged = results.merge(baseline, on=['n_users', 'stage'], how='left', suffixes=('', '_baseline'))
+    merged['wall_ratio'] = merged['wall_s'] / merged['wall_s_baseline']
+    merged['peak_ratio'] = merged['peak_mb'] / merged['peak_mb_baseline']
+    return merged.drop(columns=['wall_s_baseline', 'peak_mb_baseline'])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='append the results to this JSON lines file')
+    parser.add_argument('--baseline', help='JSON lines file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore', FutureWarning)
+
+    results = benchmark(args.sizes, seed=args.seed)
+
+    if args.output:
+        run = results.assign(run_at=datetime.now().isoformat(timespec='seconds'), seed=args.seed)
+        with open(args.output, 'a') as f:
+            f.write(run.to_json(orient='records', lines=True))
+
+    if args.baseline:
+        results = compare_with_baseline(results, args.baseline)
+
+    print(results.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+
+if __name__ == '__main__':
+    main()
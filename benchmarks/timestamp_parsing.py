@@ -0,0 +1,67 @@
+"""
+Benchmark the per-cell parse_unix_or_date (.apply) path against the vectorized
+parse_unix_or_date_series on the bundled CSV and JSON timestamp columns.
+
+Run from the repository root:
+
+    python -m benchmarks.timestamp_parsing
+"""
+import argparse
+import json
+import timeit
+import warnings
+
+import pandas as pd
+
+from utils.load_n_transform import parse_unix_or_date, parse_unix_or_date_series
+
+
+def load_raw_columns(backend_path='data/allowance_backend_table.csv', events_path='data/allowance_events.json') -> dict:
+
+    allowance_backend_table = pd.read_csv(backend_path)
+
+    with open(events_path) as f:
+        allowance_events = pd.json_normalize(json.load(f))
+
+    return {
+        'creation_date': allowance_backend_table['creation_date'],
+        'updated_at': allowance_backend_table['updated_at'],
+        'event.timestamp': allowance_events['event.timestamp'],
+    }
+
+def benchmark(columns: dict, repeat=5) -> pd.DataFrame:
+    """
+    Time both parsers on each column (best of repeat runs) and check that they agree.
+    """
+    records = []
+    for name, values in columns.items():
+        apply_result = values.apply(parse_unix_or_date)
+        vectorized_result = parse_unix_or_date_series(values)
+
+        apply_time = min(timeit.repeat(lambda: values.apply(parse_unix_or_date), number=1, repeat=repeat))
+        vectorized_time = min(timeit.repeat(lambda: parse_unix_or_date_series(values), number=1, repeat=repeat))
+
+        records.append({
+            'column': name,
+            'rows': len(values),
+            'apply_s': apply_time,
+            'vectorized_s': vectorized_time,
+            'speedup': apply_time / vectorized_time,
+            'identical': apply_result.equals(vectorized_result) and apply_result.dtype == vectorized_result.dtype
+        })
+
+    return pd.DataFrame(records)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # The .apply path triggers pandas' deprecation warning for string epochs on every cell.
+    warnings.simplefilter('ignore', FutureWarning)
+
+    print(benchmark(load_raw_columns(), repeat=args.repeat).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
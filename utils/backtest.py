@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+from utils.instrument import instrumented
+from utils.payment_schedule import get_next_payment_dates, normalize_scheduled_days
+
+
+# backtest expected payment dates ---------------------------------------------------------
+@instrumented('backtest.backtest_next_payment_days')
+def backtest_next_payment_days(events_df: pd.DataFrame, as_of_dates, pivot=False) -> pd.DataFrame:
+    """
+    Compute the expected next_payment_day of every user at every as-of date in one sweep.
+
+    At each as-of date only the events known by the end of that day are used: the latest of
+    them (an as-of join per user) sets frequency and day, and the next payment date is computed
+    with the batch engine using the as-of date as both base and current date, the way
+    update_allowance_backend_table does for CURRENT_DATE. Users without any event yet at a
+    date are left out of the long frame (NaN in the matrix); events with a NaT event.timestamp
+    are never known.
+
+    Args:
+        events_df (pd.DataFrame): The allowance events (get_allowance_events); left unmodified.
+        as_of_dates (array-like): The dates to evaluate, e.g. pd.date_range('2024-11-01', '2024-12-03').
+        pivot (bool): Return a uuid x as_of_date matrix of next_payment_day instead of the long frame.
+
+    Returns:
+        pd.DataFrame: Long frame with columns 'uuid', 'as_of_date', 'frequency', 'day', 'updated_at',
+                    'next_payment_day', ordered by as_of_date and uuid; or the pivoted matrix.
+    """
+    as_of_dates = pd.DatetimeIndex(pd.to_datetime(as_of_dates)).normalize().unique().sort_values()
+
+    events = events_df[events_df['user.id'].notna()][
+        ['user.id', 'event.timestamp', 'allowance.scheduled.frequency', 'allowance.scheduled.day']
+    ]
+    events = events.assign(**{'event.timestamp': pd.to_datetime(events['event.timestamp'])})
+    # events without a timestamp cannot be placed before any as-of date (and merge_asof rejects null keys)
+    events = events[events['event.timestamp'].notna()]
+    events = events.sort_values('event.timestamp', kind='stable')
+
+    # every (user, date) pair, with the end of the as-of day as the cut-off for known events
+    users = np.sort(np.asarray(events['user.id'].unique(), dtype=object))
+    grid = pd.DataFrame({
+        'user.id': pd.Series(np.tile(users, len(as_of_dates))).astype(events['user.id'].dtype),
+        'as_of_date': np.repeat(as_of_dates.to_numpy(), len(users)),
+    })
+    grid['cutoff'] = grid['as_of_date'] + pd.Timedelta(days=1)
+
+    known = pd.merge_asof(
+        grid,
+        events,
+        left_on='cutoff',
+        right_on='event.timestamp',
+        by='user.id',
+        direction='backward',
+        allow_exact_matches=False
+    )
+    known = known[known['event.timestamp'].notna()]
+
+    frequency = known['allowance.scheduled.frequency']
+    day = known['allowance.scheduled.day']
+    expected = get_next_payment_dates(
+        frequency, normalize_scheduled_days(frequency, day), known['as_of_date'], known['as_of_date']
+    )
+
+    backtest = pd.DataFrame({
+        'uuid': known['user.id'].to_numpy(),
+        'as_of_date': known['as_of_date'].to_numpy(),
+        'frequency': frequency.to_numpy(),
+        'day': day.to_numpy(),
+        'updated_at': known['event.timestamp'].to_numpy(),
+        'next_payment_day': pd.Series(expected).dt.day.astype(float).to_numpy()
+    })
+
+    if pivot:
+        return backtest.pivot(index='uuid', columns='as_of_date', values='next_payment_day').reindex(
+            index=users, columns=as_of_dates
+        ).rename_axis(index='uuid', columns='as_of_date')
+
+    return backtest
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+
+# on-disk columnar cache   ----------------------------------------------------------------
+def cache_dir_for(path: str, name: str) -> str:
+    """
+    Cache directory of one loader's output for a source file, stored next to the source.
+    """
+    return os.path.join(f"{path}.cache", name)
+
+def file_hash(path: str, block_size=1 << 20) -> str:
+    """
+    BLAKE2b digest of a file's contents, read in blocks.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_signature(path: str, with_hash=True) -> dict:
+
+    stat = os.stat(path)
+    signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if with_hash:
+        signature['hash'] = file_hash(path)
+
+    return signature
+
+def _encode_tz(tz) -> dict:
+    """
+    Fixed offsets (including datetime.timezone.utc) are stored as seconds, named zones by name.
+    """
+    if isinstance(tz, timezone):
+        return {'offset': tz.utcoffset(None).total_seconds()}
+    return {'name': str(tz)}
+
+def _decode_tz(spec: dict):
+
+    if 'offset' in spec:
+        offset = timedelta(seconds=spec['offset'])
+        return timezone.utc if not offset else timezone(offset)
+    return spec['name']
+
+def _save(cache_dir: str, name: str, array: np.ndarray) -> str:
+
+    filename = f"{name}.npy"
+    np.save(os.path.join(cache_dir, filename), array, allow_pickle=False)
+    return filename
+
+def _load(cache_dir: str, filename: str) -> np.ndarray:
+
+    # copy-on-write mapping: the frame can be modified like a freshly parsed one, the .npy files are never touched;
+    # handed back as a plain ndarray view, not an np.memmap
+    return np.asarray(np.load(os.path.join(cache_dir, filename), mmap_mode='c', allow_pickle=False))
+
+def _write_column(cache_dir: str, name: str, values) -> dict:
+    """
+    Write one column (or the index) as .npy files and return its spec for meta.json.
+    Raises TypeError for columns without a fixed-width binary layout.
+    """
+    values = pd.Series(values)
+    dtype = values.dtype
+
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return {
+            'kind': 'datetimetz',
+            'values': _save(cache_dir, name, values.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy()),
+            'tz': _encode_tz(dtype.tz)
+        }
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Dictionary-encoded (compact) columns: integer codes plus the categories as their own column.
+        return {
+            'kind': 'category',
+            'values': _save(cache_dir, name, values.cat.codes.to_numpy()),
+            'categories': _write_column(cache_dir, f"{name}.categories", dtype.categories),
+            'ordered': bool(dtype.ordered)
+        }
+
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and hasattr(dtype, 'numpy_dtype'):
+        # Nullable integer/float/boolean columns: plain values plus a missing-value mask.
+        missing = values.isna().to_numpy()
+        return {
+            'kind': 'masked',
+            'dtype': str(dtype),
+            'values': _save(cache_dir, name, values.to_numpy(dtype=dtype.numpy_dtype, na_value=0)),
+            'missing': _save(cache_dir, f"{name}.missing", missing)
+        }
+
+    if dtype != object:
+        return {'kind': 'array', 'values': _save(cache_dir, name, values.to_numpy())}
+
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    missing = values.isna().to_numpy()
+
+    if inferred in ('string', 'empty'):
+        # Fixed-width UTF-8 bytes plus a missing-value mask.
+        encoded = values.where(~missing, '').str.encode('utf-8').to_numpy(dtype=bytes)
+        return {
+            'kind': 'string',
+            'values': _save(cache_dir, name, encoded),
+            'missing': _save(cache_dir, f"{name}.missing", missing)
+        }
+
+    if inferred == 'datetime' and values[~missing].map(lambda v: isinstance(v, pd.Timestamp)).all():
+        # Mixed naive/tz-aware timestamps: naive wall times or UTC instants, plus an aware mask.
+        present = values[~missing]
+        aware = present.map(lambda v: v.tz is not None).to_numpy(dtype=bool)
+        zones = {str(v.tz) for v in present[aware]}
+        if len(zones) > 1:
+            raise TypeError(f"Column {name} mixes several time zones")
+
+        nanoseconds = np.zeros(len(values), dtype=np.int64)
+        nanoseconds[~missing] = [v.value for v in present]
+        is_aware = np.zeros(len(values), dtype=bool)
+        is_aware[~missing] = aware
+
+        return {
+            'kind': 'timestamps',
+            'values': _save(cache_dir, name, nanoseconds.view('datetime64[ns]')),
+            'aware': _save(cache_dir, f"{name}.aware", is_aware),
+            'missing': _save(cache_dir, f"{name}.missing", missing),
+            'tz': _encode_tz(present[aware].iloc[0].tz) if aware.any() else None
+        }
+
+    raise TypeError(f"Column {name} of inferred type {inferred} cannot be cached")
+
+def _read_column(cache_dir: str, spec: dict):
+
+    values = _load(cache_dir, spec['values'])
+    kind = spec['kind']
+
+    if kind == 'array':
+        return values
+
+    if kind == 'datetimetz':
+        return pd.DatetimeIndex(values).tz_localize('UTC').tz_convert(_decode_tz(spec['tz']))
+
+    if kind == 'category':
+        categories = pd.Index(_read_column(cache_dir, spec['categories']))
+        return pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories, ordered=spec['ordered']))
+
+    missing = _load(cache_dir, spec['missing'])
+
+    if kind == 'string':
+        decoded = np.char.decode(values, 'utf-8').astype(object)
+        decoded[missing] = np.nan
+        return decoded
+
+    if kind == 'masked':
+        return pd.Series(values).astype(spec['dtype']).mask(missing).array
+
+    if kind == 'timestamps':
+        aware = _load(cache_dir, spec['aware'])
+        result = np.full(len(values), None, dtype=object)
+
+        naive = ~aware & ~missing
+        result[naive] = pd.DatetimeIndex(values[naive]).astype(object)
+        if aware.any():
+            tz = _decode_tz(spec['tz'])
+            result[aware] = pd.DatetimeIndex(values[aware]).tz_localize('UTC').tz_convert(tz).astype(object)
+        result[missing] = pd.NaT
+        return result
+
+    raise ValueError(f"Unknown cached column kind: {kind}")
+
+def write_cache(df: pd.DataFrame, cache_dir: str, signature: dict):
+    """
+    Write df to cache_dir as one .npy file per column plus a meta.json with the source signature.
+    The directory is written next to its final location and swapped in at the end, so readers
+    never see a partial cache.
+    """
+    parent = os.path.dirname(cache_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent)
+
+    try:
+        meta = {
+            'version': CACHE_VERSION,
+            'source': signature,
+            'index': _write_column(tmp_dir, 'index', df.index),
+            'columns': [
+                {'name': col, **_write_column(tmp_dir, f"column_{i}", df[col])}
+                for i, col in enumerate(df.columns)
+            ]
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, cache_dir)
+
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+def read_cache(cache_dir: str) -> pd.DataFrame:
+    """
+    Load a cached DataFrame; fixed-width numeric and datetime columns stay memory-mapped
+    (copy-on-write, so writes to the frame stay in the process).
+    """
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    columns = {spec['name']: _read_column(cache_dir, spec) for spec in meta['columns']}
+    index = pd.Index(_read_column(cache_dir, meta['index']))
+
+    return pd.DataFrame(columns, index=index, copy=False)
+
+def is_cache_valid(cache_dir: str, path: str) -> bool:
+    """
+    A cache is valid when the source size matches and either its mtime matches
+    or, after a touch or copy, its content hash still does.
+    """
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    cached = meta.get('source', {})
+    current = source_signature(path, with_hash=False)
+
+    if meta.get('version') != CACHE_VERSION or cached.get('size') != current['size']:
+        return False
+
+    if cached.get('mtime_ns') == current['mtime_ns']:
+        return True
+
+    if cached.get('hash') != file_hash(path):
+        return False
+
+    # Same content under a new mtime: remember it to skip hashing next time.
+    meta['source']['mtime_ns'] = current['mtime_ns']
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    return True
+
+def load_cached(path: str, name: str, loader) -> pd.DataFrame:
+    """
+    Return loader()'s result for the source file at path, using the binary columnar cache
+    when it is valid and (re)building it otherwise. Frames with columns that have no
+    binary layout are returned as loaded, without caching.
+
+    Args:
+        path (str): The source file the loader parses.
+        name (str): Cache name, unique per loader and loader options.
+        loader (callable): Parses the source and returns the typed DataFrame.
+
+    Returns:
+        pd.DataFrame: The loaded (or cached) DataFrame.
+    """
+    cache_dir = cache_dir_for(path, name)
+    if is_cache_valid(cache_dir, path):
+        return read_cache(cache_dir)
+
+    # Sign the source before parsing so a concurrent change invalidates the cache.
+    signature = source_signature(path)
+    df = loader()
+
+    try:
+        write_cache(df, cache_dir, signature)
+    except TypeError:
+        pass
+
+    return df
@@ -0,0 +1,182 @@
+"""
+Headless reconciliation: load the three sources, update the allowance backend table from the
+events, generate the expected payment schedule, compare both against the backend tables and
+write the report, without a notebook. Plotting libraries are only imported with --plots.
+
+Run from the repository root:
+
+    python -m utils.cli --output-dir report
+    python -m utils.cli --output-dir report --cache --fail-on-diff
+    python -m utils.cli --output-dir report --plots
+
+The report directory gets the differences (diff.csv or diff.jsonl, with the columns of
+utils.reconcile.reconcile) and summary.json with the row and difference counts per table,
+per compared column and per frequency.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from utils.compare import CsvDiffSink, DiffSummary, JsonLinesDiffSink, write_backend_diffs
+from utils.load_n_transform import get_allowance_backend_table, get_payment_schedule_backend_table, get_allowance_events
+from utils.payment_schedule import update_allowance_backend_table, generate_payment_schedule_backend_table
+from utils.reconcile import DIFF_REPORT_COLUMNS
+
+PLOTS = ['payment_dates', 'allowance_amounts', 'categorical_variables', 'contingency_table']
+
+
+# headless reconciliation  ----------------------------------------------------------------
+def run_reconciliation(allowance_backend_path: str, payment_schedule_path: str, allowance_events_path: str,
+                       output_dir: str, output_format='csv', cache=False, compact=False, plots=False) -> dict:
+    """
+    Run load -> update -> generate schedule -> compare and write the report to output_dir.
+
+    Args:
+        allowance_backend_path (str): Path to the allowance backend table CSV.
+        payment_schedule_path (str): Path to the payment schedule backend table CSV.
+        allowance_events_path (str): Path to the allowance events JSON.
+        output_dir (str): Directory for the differences, summary.json and plots (created if needed).
+        output_format (str): 'csv' or 'jsonl' for the differences file.
+        cache (bool): Use the on-disk columnar cache of the loaders.
+        compact (bool): Load compact (categorical / UInt8) tables.
+        plots (bool): Also save the distribution plots as PNG files under output_dir/plots.
+
+    Returns:
+        dict: The summary written to summary.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    allowance_backend_table = get_allowance_backend_table(allowance_backend_path, cache=cache, compact=compact)
+    payment_schedule_backend_table = get_payment_schedule_backend_table(payment_schedule_path, cache=cache, compact=compact)
+    allowance_events = get_allowance_events(allowance_events_path, cache=cache, compact=compact)
+
+    allowance_backend_df = update_allowance_backend_table(allowance_backend_table, allowance_events.copy())
+    payment_schedule_df = generate_payment_schedule_backend_table(allowance_backend_df)
+
+    if output_format == 'jsonl':
+        diff_path = os.path.join(output_dir, 'diff.jsonl')
+        sink = JsonLinesDiffSink(diff_path)
+    else:
+        diff_path = os.path.join(output_dir, 'diff.csv')
+        sink = CsvDiffSink(diff_path, columns=DIFF_REPORT_COLUMNS)
+
+    # differences are counted per frequency of the updated allowance
+    frequencies = allowance_backend_df.set_index('uuid')['frequency']
+    summaries = {}
+    for table, updated_df, original_df in [
+        ('allowance_backend_table', allowance_backend_df, allowance_backend_table),
+        ('payment_schedule_backend_table', payment_schedule_df, payment_schedule_backend_table)
+    ]:
+        summaries[table] = write_backend_diffs(
+            updated_df.set_index('uuid'),
+            original_df.set_index('uuid'),
+            sink,
+            frequencies=frequencies,
+            table=table,
+            summary=DiffSummary()
+        )
+
+    summary = {
+        'differences_path': diff_path,
+        'rows': {
+            'allowance_backend_table': len(allowance_backend_table),
+            'payment_schedule_backend_table': len(payment_schedule_backend_table),
+            'allowance_events': len(allowance_events)
+        },
+        'differences': {
+            table: {
+                'total': table_summary.total,
+                'by_column': table_summary.by_column,
+                'by_frequency': {str(key): count for key, count in table_summary.by_frequency.items()}
+            }
+            for table, table_summary in summaries.items()
+        }
+    }
+
+    if plots:
+        summary['plots'] = save_plots(
+            os.path.join(output_dir, 'plots'), payment_schedule_backend_table, allowance_events
+        )
+
+    summary['wall_s'] = time.perf_counter() - start
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return summary
+
+def save_plots(plots_dir: str, payment_schedule_backend_table, allowance_events) -> dict:
+    """
+    Save the notebook's distribution plots as PNG files with a non-interactive backend.
+    Plotting libraries are imported here only; a plot that fails is reported and skipped.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from utils.plot import (
+        plot_categorical_variables,
+        plot_contingency_table,
+        top_n_allowances_plot,
+        top_n_payment_dates_plot
+    )
+
+    os.makedirs(plots_dir, exist_ok=True)
+    plot_functions = {
+        'payment_dates': lambda: top_n_payment_dates_plot(payment_schedule_backend_table),
+        'allowance_amounts': lambda: top_n_allowances_plot(allowance_events, top_n=3),
+        'categorical_variables': lambda: plot_categorical_variables(allowance_events),
+        'contingency_table': lambda: plot_contingency_table(allowance_events)
+    }
+
+    saved = {}
+    for name in PLOTS:
+        try:
+            plot_functions[name]()
+            path = os.path.join(plots_dir, f"{name}.png")
+            plt.gcf().savefig(path, dpi=150, bbox_inches='tight')
+            saved[name] = path
+        except Exception as e:
+            print(f"plot {name} failed: {e}", file=sys.stderr)
+        finally:
+            plt.close('all')
+
+    return saved
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--allowance-backend', default='data/allowance_backend_table.csv')
+    parser.add_argument('--payment-schedule', default='data/payment_schedule_backend_table.csv')
+    parser.add_argument('--allowance-events', default='data/allowance_events.json')
+    parser.add_argument('--output-dir', default='report')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='format of the differences file')
+    parser.add_argument('--cache', action='store_true', help='use the on-disk columnar cache of the loaders')
+    parser.add_argument('--compact', action='store_true', help='load compact categorical / UInt8 tables')
+    parser.add_argument('--plots', action='store_true', help='also save the distribution plots (imports matplotlib and seaborn)')
+    parser.add_argument('--fail-on-diff', action='store_true', help='exit with status 1 when any difference is found')
+    args = parser.parse_args(argv)
+
+    summary = run_reconciliation(
+        args.allowance_backend,
+        args.payment_schedule,
+        args.allowance_events,
+        args.output_dir,
+        output_format=args.format,
+        cache=args.cache,
+        compact=args.compact,
+        plots=args.plots
+    )
+
+    total = 0
+    for table, differences in summary['differences'].items():
+        print(f"{table}: {differences['total']:,} differences in {summary['rows'][table]:,} rows")
+        total += differences['total']
+    print(f"report written to {args.output_dir} in {summary['wall_s']:.2f}s")
+
+    return 1 if args.fail_on_diff and total else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,42 @@
+import pandas as pd
+
+# compact mode: dictionary-encoded enum-like and uuid columns, small integer day-of-month columns
+CATEGORICAL_COLUMNS = [
+    'uuid',
+    'user.id',
+    'frequency',
+    'day',
+    'status',
+    'event.name',
+    'allowance.scheduled.frequency',
+    'allowance.scheduled.day'
+]
+
+DAY_OF_MONTH_COLUMNS = ['next_payment_day', 'payment_date']
+
+
+# compact representation  ----------------------------------------------------------------
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return a compact copy of a loaded table: uuids and enum-like columns become categoricals
+    (integer codes plus one copy of each distinct string) when their values repeat, and
+    day-of-month columns become nullable UInt8. Columns that are not present are skipped.
+    """
+    df = df.copy()
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            # Dictionary encoding only pays off when values repeat (e.g. uuids in the events).
+            if df[col].nunique() <= len(df) // 2:
+                df[col] = df[col].astype('category')
+
+    for col in DAY_OF_MONTH_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('UInt8')
+
+    return df
+
+def is_compact(df: pd.DataFrame) -> bool:
+
+    columns = [col for col in CATEGORICAL_COLUMNS + DAY_OF_MONTH_COLUMNS if col in df.columns]
+    return any(isinstance(df[col].dtype, (pd.CategoricalDtype, pd.UInt8Dtype)) for col in columns)
@@ -1,60 +1,338 @@
+import numpy as np
 import pandas as pd
 
+from utils.instrument import instrumented
+
+DIFF_COLUMNS = ['next_payment_day', 'payment_date']
+
+CONSISTENCY_COLUMNS = ['issue', 'table', 'uuid', 'payment_date', 'next_payment_day']
+
+
 # compare differences      -----------------------------------------------------------------
-def compare_backend_dfs(updated_df: pd.DataFrame, original_df: pd.DataFrame) -> pd.DataFrame:
+def _comparable(values: pd.Series) -> pd.Series:
+    """
+    Categoricals with different categories cannot be compared with each other: compare their values.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    return values
+
+def _compared_columns(updated_df: pd.DataFrame, original_df: pd.DataFrame, columns) -> list:
+    """
+    The requested columns present in both frames, in the column order of original_df.
+    """
+    if columns is None:
+        columns = list(original_df.columns)
+
+    # Columns missing from either side cannot be paired up, so they never produce differences.
+    return [col for col in original_df.columns if col in columns and col in updated_df.columns]
+
+def _value_dtype(updated_df: pd.DataFrame, original_df: pd.DataFrame):
+    """
+    dtype of the 'original' and 'updated' values, as a row-by-row scan of the merged frames
+    yields them: float when every column is numeric, object otherwise.
+    """
+    dtypes = list(original_df.dtypes) + list(updated_df.dtypes)
+    numeric = all(pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) for dtype in dtypes)
+    return float if numeric else object
+
+def _merge_columns(updated_df: pd.DataFrame, original_df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    """
+    Outer-merge the compared columns on the index, with _original/_updated suffixes.
+    """
+    # Merge only the requested columns on the index using an outer join.
+    # Suffixes will help differentiate values coming from each DataFrame.
+    return original_df[columns].merge(
+        updated_df[columns],
+        left_index=True,
+        right_index=True,
+        how='outer',
+        suffixes=('_original', '_updated')
+    )
+
+def _values(values: pd.Series, dtype) -> np.ndarray:
+    """
+    The values as a float array (missing values as NaN) or an object array.
+    """
+    if dtype is float:
+        return values.to_numpy(dtype=float, na_value=np.nan)
+    return values.to_numpy(dtype=object)
+
+def _diff_rows(merged: pd.DataFrame, columns: list, dtype=object) -> pd.DataFrame:
+    """
+    Differences of the merged rows, one column at a time with NaN-aware masks, in row-major order.
+    The 'original' and 'updated' values are converted to dtype (see _value_dtype).
+    """
+    diff_frames = []
+    for col in columns:
+        original_vals = _comparable(merged[col + "_original"])
+        updated_vals  = _comparable(merged[col + "_updated"])
+        original_na = original_vals.isna().to_numpy()
+        updated_na  = updated_vals.isna().to_numpy()
+
+        # A difference is a NaN on only one side, or two non-NaN values that differ.
+        differs = (original_na != updated_na) | (
+            ~original_na & ~updated_na & (original_vals != updated_vals).to_numpy(dtype=bool, na_value=False)
+        )
+        rows = np.flatnonzero(differs)
+        diff_frames.append(pd.DataFrame({
+            "uuid": merged.index[rows],
+            "column": col,
+            "original": _values(original_vals.iloc[rows], dtype),
+            "updated": _values(updated_vals.iloc[rows], dtype),
+            "_row": rows
+        }))
+
+    # Restore the row-major order of a row-by-row scan.
+    diff_df = pd.concat(diff_frames, ignore_index=True)
+    diff_df = diff_df.sort_values('_row', kind='stable').drop(columns='_row').reset_index(drop=True)
+    return diff_df
+
+@instrumented('compare.compare_backend_dfs')
+def compare_backend_dfs(updated_df: pd.DataFrame, original_df: pd.DataFrame, columns=DIFF_COLUMNS) -> pd.DataFrame:
     """
     Compare two backend DataFrames (updated and original) and return a DataFrame listing differences.
-    
-    For each row (keyed by index) and each column in the original DataFrame,
+
+    For each row (keyed by index) and each requested column of the original DataFrame,
     the function outputs:
       - the index (key),
       - the column name,
       - the original value,
       - and the updated value.
-      
+
     An outer merge on the index is performed to handle cases where indices differ between the two DataFrames.
-    
+    Only the requested columns are merged and compared, one column at a time with NaN-aware masks
+    (two NaN values are treated as equal).
+
     Args:
         updated_df (pd.DataFrame): The DataFrame with updated records.
         original_df (pd.DataFrame): The original DataFrame.
-    
+        columns (list): Columns to compare. Defaults to next_payment_day and payment_date;
+                        None compares every column of original_df.
+
     Returns:
-        pd.DataFrame: A DataFrame with columns: 'index', 'column', 'original', 'updated'
-                    for each difference found.
+        pd.DataFrame: A DataFrame with columns: 'uuid', 'column', 'original', 'updated'
+                    for each difference found, ordered by row and then by column.
     """
-    
-    # Merge the two DataFrames on the index using an outer join.
-    # Suffixes will help differentiate values coming from each DataFrame.
-    merged = original_df.merge(
-        updated_df,
-        left_index=True,
-        right_index=True,
-        how='outer',
-        suffixes=('_original', '_updated')
-    )
-    
-    diff_records = []
-    # Iterate over each row in the merged DataFrame.
-    for idx, row in merged.iterrows():
-        # Iterate over each column from the original DataFrame.
-        for col in original_df.columns:
-            original_val = row.get(col + "_original")
-            updated_val  = row.get(col + "_updated")
-            # Treat two NaN values as equal.
-            if pd.isna(original_val) and pd.isna(updated_val):
-                continue
-            # If one value is NaN or the values differ, record the difference.
-            if (pd.isna(original_val) and not pd.isna(updated_val)) or \
-               (not pd.isna(original_val) and pd.isna(updated_val)) or \
-               (original_val != updated_val):
-                diff_records.append({
-                    "uuid": idx,
-                    "column": col,
-                    "original": original_val,
-                    "updated": updated_val
-                })
-    
-    # Convert the list of difference records into a DataFrame.
-    diff_df = pd.DataFrame(diff_records)
-    diff_df = diff_df[diff_df['column'].isin(['next_payment_day', 'payment_date'])]
-    return diff_df
+    columns = _compared_columns(updated_df, original_df, columns)
+    if not columns:
+        return pd.DataFrame(columns=['uuid', 'column', 'original', 'updated'])
+
+    return _diff_rows(_merge_columns(updated_df, original_df, columns), columns, _value_dtype(updated_df, original_df))
+
+# stream differences       ----------------------------------------------------------------
+def _key_batches(df: pd.DataFrame, keys: pd.Index, batch_size: int) -> tuple:
+    """
+    Row positions of df ordered by the batch of their key (batch_size consecutive keys of the
+    sorted keys per batch), and where each batch starts, without copying any column.
+    """
+    batch = keys.get_indexer(df.index) // batch_size
+    order = np.argsort(batch, kind='stable')
+    n_batches = -(-len(keys) // batch_size)
+    return order, np.searchsorted(batch[order], np.arange(n_batches + 1))
+
+def iter_backend_diffs(updated_df: pd.DataFrame, original_df: pd.DataFrame, columns=DIFF_COLUMNS, batch_size=100_000):
+    """
+    Generator version of compare_backend_dfs: the sorted keys of both frames are split into
+    batches of batch_size keys, and only the rows of one batch are merged and compared at a
+    time; the differences of each batch are yielded as a DataFrame (batches without differences
+    are skipped). Besides the inputs, only the union of the keys and row positions are held for
+    the whole run. Concatenated, the batches hold the rows of compare_backend_dfs' result,
+    ordered by key.
+    """
+    columns = _compared_columns(updated_df, original_df, columns)
+    if not columns:
+        return
+
+    dtype = _value_dtype(updated_df, original_df)
+    keys = original_df.index.append(updated_df.index).unique().sort_values()
+    original_order, original_bounds = _key_batches(original_df, keys, batch_size)
+    updated_order, updated_bounds = _key_batches(updated_df, keys, batch_size)
+
+    for i in range(len(original_bounds) - 1):
+        merged = _merge_columns(
+            updated_df.iloc[updated_order[updated_bounds[i]:updated_bounds[i + 1]]],
+            original_df.iloc[original_order[original_bounds[i]:original_bounds[i + 1]]],
+            columns
+        )
+        # the merge leaves a batch with rows on one side only in row order
+        merged = merged.iloc[np.argsort(keys.get_indexer(merged.index), kind='stable')]
+        diff_df = _diff_rows(merged, columns, dtype)
+        if len(diff_df):
+            yield diff_df
+
+class CsvDiffSink:
+    """
+    Write difference batches to a CSV file, truncating it first. With columns, the header is
+    written right away (so a run without differences still leaves a valid file).
+    """
+
+    def __init__(self, path: str, columns=None):
+        self.path = path
+        self.header = True
+        open(path, 'w').close()
+        if columns is not None:
+            self(pd.DataFrame(columns=columns))
+
+    def __call__(self, diff_df: pd.DataFrame):
+        diff_df.to_csv(self.path, mode='a', header=self.header, index=False)
+        self.header = False
+
+class JsonLinesDiffSink:
+    """
+    Write difference batches to a file as one JSON object per line, truncating it first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        open(path, 'w').close()
+
+    def __call__(self, diff_df: pd.DataFrame):
+        with open(self.path, 'a') as f:
+            f.write(diff_df.to_json(orient='records', lines=True, date_format='iso'))
+
+class DiffSummary:
+    """
+    Running counts of the streamed differences: in total, per compared column and per frequency.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.by_column = {}
+        self.by_frequency = {}
+
+    def update(self, diff_df: pd.DataFrame, frequencies=None):
+        """
+        Count one batch; frequencies (a Series indexed by uuid) gives each difference its frequency.
+        """
+        self.total += len(diff_df)
+        for col, count in diff_df['column'].value_counts(sort=False).items():
+            self.by_column[col] = self.by_column.get(col, 0) + int(count)
+
+        if frequencies is not None:
+            frequency = frequencies.reindex(diff_df['uuid'].to_numpy())
+            counts = frequency.value_counts(sort=False, dropna=False)
+            # categorical (compact) frequencies also list their unobserved categories with a zero count
+            for freq, count in counts[counts > 0].items():
+                freq = None if pd.isna(freq) else freq
+                self.by_frequency[freq] = self.by_frequency.get(freq, 0) + int(count)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The counters as one long frame with columns 'dimension', 'value', 'differences'.
+        """
+        rows = [('column', key, count) for key, count in self.by_column.items()]
+        rows += [('frequency', key, count) for key, count in self.by_frequency.items()]
+        return pd.DataFrame(rows, columns=['dimension', 'value', 'differences'])
+
+@instrumented('compare.write_backend_diffs')
+def write_backend_diffs(updated_df: pd.DataFrame, original_df: pd.DataFrame, sink, columns=DIFF_COLUMNS,
+                        frequencies=None, table=None, summary=None, batch_size=100_000) -> DiffSummary:
+    """
+    Stream the differences of compare_backend_dfs to sink in batches instead of returning them.
+
+    Args:
+        updated_df (pd.DataFrame): The DataFrame with updated records.
+        original_df (pd.DataFrame): The original DataFrame.
+        sink (callable): Receives each batch of differences, e.g. CsvDiffSink(path),
+                         JsonLinesDiffSink(path) or any function.
+        columns (list): Columns to compare, as in compare_backend_dfs.
+        frequencies (pd.Series): Frequency per uuid for the per-frequency counters,
+                                 e.g. updated_df.set_index('uuid')['frequency'].
+        table (str): When given, a leading 'table' column with this value is added to every batch.
+        summary (DiffSummary): Counters to continue, e.g. across tables or chunks.
+        batch_size (int): Keys (index values) merged and compared per batch.
+
+    Returns:
+        DiffSummary: The running counters, updated with these differences.
+    """
+    summary = summary if summary is not None else DiffSummary()
+    if frequencies is not None:
+        frequencies = frequencies[~frequencies.index.duplicated(keep='last')]
+
+    for diff_df in iter_backend_diffs(updated_df, original_df, columns=columns, batch_size=batch_size):
+        summary.update(diff_df, frequencies)
+        if table is not None:
+            diff_df.insert(0, 'table', table)
+        sink(diff_df)
+
+    return summary
+
+# cross-table consistency  ----------------------------------------------------------------
+@instrumented('compare.check_cross_table_consistency')
+def check_cross_table_consistency(allowance_backend_df: pd.DataFrame, payment_schedule_df: pd.DataFrame, only_enabled=True) -> pd.DataFrame:
+    """
+    Check the payment schedule backend table against the allowance backend table in one pass.
+
+    A hash index of the allowance uuids is built once; every schedule row is then looked up
+    in it a single time, which gives the unexpected rows (no enabled allowance: the allowance
+    is disabled or its uuid is unknown to the allowance table), the mismatched rows
+    (payment_date differs from next_payment_day, NaN-aware) and which allowances have a
+    schedule row at all (the rest are missing). Duplicated uuids of both tables come from the
+    same hash tables, and rows of duplicated allowances are matched with the last one.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): The allowance backend table.
+        payment_schedule_df (pd.DataFrame): The payment schedule backend table.
+        only_enabled (bool): Only enabled allowances should have a schedule row; when False,
+                             every allowance should and only unknown uuids are unexpected.
+
+    Returns:
+        pd.DataFrame: One row per issue with columns 'issue' ('missing', 'unexpected', 'duplicated'
+                    or 'mismatched'), 'table', 'uuid', 'payment_date', 'next_payment_day'.
+    """
+    allowance_uuids = pd.Index(allowance_backend_df['uuid'].astype(object))
+    schedule_uuids = pd.Index(payment_schedule_df['uuid'].astype(object))
+    next_payment_day = allowance_backend_df['next_payment_day'].to_numpy(dtype=float, na_value=np.nan)
+    payment_date = payment_schedule_df['payment_date'].to_numpy(dtype=float, na_value=np.nan)
+
+    # hash index of the allowances, the last row of a duplicated uuid wins
+    last = ~allowance_uuids.duplicated(keep='last')
+    index = allowance_uuids[last]
+    rows = np.flatnonzero(last)
+
+    positions = index.get_indexer(schedule_uuids)
+    found = positions >= 0
+    allowance_rows = rows[positions[found]]
+
+    scheduled = np.zeros(len(allowance_uuids), dtype=bool)
+    scheduled[allowance_rows] = True
+    # every row of a duplicated allowance counts as scheduled
+    scheduled = pd.Series(scheduled).groupby(allowance_uuids.to_numpy()).transform('any').to_numpy() if (~last).any() else scheduled
+
+    expected = allowance_backend_df['status'].eq("enabled").to_numpy() if only_enabled else np.ones(len(allowance_uuids), dtype=bool)
+    missing = np.flatnonzero(expected & ~scheduled)
+
+    # schedule rows of an expected allowance; the others should not exist
+    matched = np.zeros(len(schedule_uuids), dtype=bool)
+    matched[found] = expected[allowance_rows]
+    unexpected = np.flatnonzero(~matched)
+
+    expected_day = np.full(len(schedule_uuids), np.nan)
+    expected_day[found] = next_payment_day[allowance_rows]
+    schedule_na, allowance_na = np.isnan(payment_date), np.isnan(expected_day)
+    mismatched = np.flatnonzero(matched & ((schedule_na != allowance_na) | (~schedule_na & ~allowance_na & (payment_date != expected_day))))
+
+    allowance_duplicated = np.flatnonzero(allowance_uuids.duplicated(keep=False))
+    schedule_duplicated = np.flatnonzero(schedule_uuids.duplicated(keep=False))
+
+    def issues(issue: str, table: str, uuids, payment_dates, next_payment_days) -> pd.DataFrame:
+        return pd.DataFrame({
+            'issue': issue,
+            'table': table,
+            'uuid': np.asarray(uuids, dtype=object),
+            'payment_date': payment_dates,
+            'next_payment_day': next_payment_days
+        }, columns=CONSISTENCY_COLUMNS)
+
+    return pd.concat([
+        issues('missing', 'allowance_backend_table', allowance_uuids[missing], np.full(len(missing), np.nan), next_payment_day[missing]),
+        issues('unexpected', 'payment_schedule_backend_table', schedule_uuids[unexpected],
+               payment_date[unexpected], expected_day[unexpected]),
+        issues('duplicated', 'allowance_backend_table', allowance_uuids[allowance_duplicated],
+               np.full(len(allowance_duplicated), np.nan), next_payment_day[allowance_duplicated]),
+        issues('duplicated', 'payment_schedule_backend_table', schedule_uuids[schedule_duplicated],
+               payment_date[schedule_duplicated], np.full(len(schedule_duplicated), np.nan)),
+        issues('mismatched', 'payment_schedule_backend_table', schedule_uuids[mismatched],
+               payment_date[mismatched], expected_day[mismatched])
+    ], ignore_index=True)
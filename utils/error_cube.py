@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+
+from utils.compare import DIFF_COLUMNS
+from utils.instrument import instrumented
+from utils.payment_schedule import get_latest_events
+from utils.reconcile import reconcile
+
+USER_DIMENSIONS = ['frequency', 'day', 'cohort', 'last_event']
+
+CUBE_DIMENSIONS = USER_DIMENSIONS + ['error_kind']
+
+ERROR_KINDS = DIFF_COLUMNS + ['missing_schedule_row', 'unexpected_schedule_row']
+
+UNKNOWN = 'unknown'
+
+
+# error cube               ----------------------------------------------------------------
+def _labels(values) -> np.ndarray:
+    """
+    Dimension labels as strings, with missing values (and compact categoricals) handled alike.
+    """
+    values = pd.Series(values).astype(object)
+    return values.where(values.notna(), UNKNOWN).astype(str).to_numpy()
+
+def error_kinds(diff_df: pd.DataFrame) -> np.ndarray:
+    """
+    Kind of each difference of a reconcile result: the compared column, or for the payment
+    schedule a missing_schedule_row (expected but absent) / unexpected_schedule_row (present
+    but not expected for an enabled allowance).
+    """
+    schedule = (diff_df['table'] == 'payment_schedule_backend_table').to_numpy()
+    original_na = diff_df['original'].isna().to_numpy()
+    updated_na = diff_df['updated'].isna().to_numpy()
+
+    return np.select(
+        [schedule & original_na, schedule & updated_na],
+        ['missing_schedule_row', 'unexpected_schedule_row'],
+        default=diff_df['column'].astype(str).to_numpy()
+    )
+
+def user_dimensions(allowance_backend_df: pd.DataFrame, allowance_events: pd.DataFrame, cohort='M') -> pd.DataFrame:
+    """
+    The cube's user dimensions per backend uuid: frequency and day as stored in the backend,
+    creation cohort (creation_date period, monthly by default) and the name of the latest event.
+    """
+    last_event = get_latest_events(allowance_events)['event.name']
+    creation_date = pd.to_datetime(allowance_backend_df['creation_date'])
+
+    return pd.DataFrame({
+        'frequency': _labels(allowance_backend_df['frequency']),
+        'day': _labels(allowance_backend_df['day']),
+        'cohort': _labels(creation_date.dt.to_period(cohort).astype(str).where(creation_date.notna())),
+        'last_event': _labels(last_event.reindex(allowance_backend_df['uuid'].to_numpy()).to_numpy())
+    }, index=pd.Index(allowance_backend_df['uuid'].to_numpy(), name='uuid'))
+
+class ErrorCube:
+    """
+    Reconciliation differences aggregated over frequency x day x creation cohort x last event
+    type x error kind.
+
+    cube holds the number of differences and of affected users per non-empty cell, users the
+    number of users per combination of the user dimensions (the denominators), affected_users
+    the number of users with any difference per combination of the user dimensions, and errors
+    every difference with its dimensions, sorted by them. Breakdowns are group-bys of these
+    (small) aggregates and drill-downs are index lookups, so neither scans the reconciliation
+    result again.
+    """
+
+    def __init__(self, errors: pd.DataFrame, users: pd.Series):
+        self.errors = errors.set_index(CUBE_DIMENSIONS).sort_index()
+        self.users = users
+        self.cube = self.errors.groupby(level=CUBE_DIMENSIONS, sort=True).agg(
+            errors=('uuid', 'size'),
+            affected_users=('uuid', 'nunique')
+        )
+        # A user is in one combination of the user dimensions but possibly in several error kinds.
+        self.affected_users = self.errors.groupby(level=USER_DIMENSIONS, sort=True)['uuid'].nunique()
+
+    def __len__(self) -> int:
+        return len(self.cube)
+
+    def breakdown(self, *dimensions) -> pd.DataFrame:
+        """
+        Errors, affected users, users, rate (share of the users with any difference) and
+        errors_per_user (above 1 when users differ in both tables) per value of the given
+        dimensions, e.g. breakdown('frequency', 'error_kind'). Combinations with users but no
+        errors, and error kinds (ERROR_KINDS) without errors, are listed with 0 errors.
+        """
+        dimensions = list(dimensions)
+        unknown = set(dimensions) - set(CUBE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown cube dimensions: {sorted(unknown)}")
+
+        if not dimensions:
+            breakdown = pd.DataFrame({
+                'errors': [int(self.cube['errors'].sum())],
+                'affected_users': [int(self.affected_users.sum())],
+                'users': [int(self.users.sum())]
+            })
+            return self._rates(breakdown)
+
+        if 'error_kind' in dimensions:
+            # a user counts once per error kind
+            breakdown = self.cube.groupby(level=dimensions)[['errors', 'affected_users']].sum()
+        else:
+            breakdown = self.cube.groupby(level=dimensions)[['errors']].sum()
+            breakdown['affected_users'] = self.affected_users.groupby(level=dimensions).sum()
+
+        # every combination with users (times every error kind), including those without errors
+        kinds = pd.Index(ERROR_KINDS).append(self.cube.index.get_level_values('error_kind')).unique()
+        user_dimensions = [dim for dim in dimensions if dim in USER_DIMENSIONS]
+        if user_dimensions:
+            users = self.users.groupby(level=user_dimensions).sum()
+            if 'error_kind' in dimensions:
+                cells = users.index.to_frame(index=False)
+                cells = cells.loc[cells.index.repeat(len(kinds))].assign(error_kind=np.tile(kinds, len(users)))
+                cells = pd.MultiIndex.from_frame(cells[dimensions])
+            else:
+                cells = users.index
+        else:
+            cells = kinds.rename('error_kind')
+        breakdown = breakdown.reindex(breakdown.index.union(cells), fill_value=0)
+
+        if user_dimensions:
+            user_index = breakdown.index.droplevel('error_kind') if 'error_kind' in dimensions else breakdown.index
+            breakdown['users'] = users.reindex(user_index).fillna(0).astype(np.int64).to_numpy()
+        else:
+            breakdown['users'] = int(self.users.sum())
+
+        return self._rates(breakdown).sort_values('errors', ascending=False, kind='stable')
+
+    def _rates(self, breakdown: pd.DataFrame) -> pd.DataFrame:
+
+        users = breakdown['users'].where(breakdown['users'] > 0)
+        breakdown['affected_users'] = breakdown['affected_users'].astype(np.int64)
+        breakdown['rate'] = breakdown['affected_users'] / users
+        breakdown['errors_per_user'] = breakdown['errors'] / users
+        return breakdown[['errors', 'affected_users', 'users', 'rate', 'errors_per_user']]
+
+    def drill_down(self, **filters) -> pd.DataFrame:
+        """
+        The cube cells matching the given dimension values, e.g. drill_down(frequency='daily');
+        empty when no cell matches.
+        """
+        try:
+            return self.cube.loc[self._key(filters)]
+        except KeyError:
+            return self.cube.iloc[:0]
+
+    def uuids(self, **filters) -> np.ndarray:
+        """
+        The distinct uuids with a difference in the cells matching the given dimension values.
+        """
+        try:
+            return self.errors.loc[self._key(filters), 'uuid'].unique()
+        except KeyError:
+            return self.errors['uuid'].iloc[:0].unique()
+
+    def _key(self, filters: dict) -> tuple:
+
+        unknown = set(filters) - set(CUBE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown cube dimensions: {sorted(unknown)}")
+        return tuple(filters.get(dim, slice(None)) for dim in CUBE_DIMENSIONS)
+
+@instrumented('error_cube.build_error_cube')
+def build_error_cube(allowance_backend_df: pd.DataFrame, payment_schedule_df: pd.DataFrame, allowance_events: pd.DataFrame,
+                     diff_df=None, cohort='M') -> ErrorCube:
+    """
+    Aggregate the reconciliation differences into an ErrorCube in one pass.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): The allowance backend table (as loaded, not updated).
+        payment_schedule_df (pd.DataFrame): The payment schedule backend table.
+        allowance_events (pd.DataFrame): The allowance events; left unmodified.
+        diff_df (pd.DataFrame): A reconcile / reconcile_sharded result to reuse; computed when None.
+        cohort (str): Period of the creation cohorts, e.g. 'M' (monthly) or 'W' (weekly).
+
+    Returns:
+        ErrorCube: The aggregated differences.
+    """
+    if diff_df is None:
+        diff_df = reconcile(allowance_backend_df, payment_schedule_df, allowance_events)
+
+    dimensions = user_dimensions(allowance_backend_df, allowance_events, cohort=cohort)
+    dimensions = dimensions[~dimensions.index.duplicated(keep='last')]
+
+    # One join of the differences with the user dimensions; uuids outside the backend table are 'unknown'.
+    positions = dimensions.index.get_indexer(diff_df['uuid'])
+    known = positions >= 0
+    errors = pd.DataFrame({'uuid': diff_df['uuid'].to_numpy(), 'error_kind': error_kinds(diff_df)})
+    for dim in USER_DIMENSIONS:
+        values = np.full(len(diff_df), UNKNOWN, dtype=object)
+        values[known] = dimensions[dim].to_numpy()[positions[known]]
+        errors[dim] = values
+
+    users = dimensions.groupby(USER_DIMENSIONS).size()
+    return ErrorCube(errors, users)
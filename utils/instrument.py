@@ -0,0 +1,161 @@
+import functools
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_state = threading.local()
+
+
+# stage instrumentation    ----------------------------------------------------------------
+class MemorySink:
+    """
+    Keep the stage records in memory, e.g. for notebooks and tests.
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.records)
+
+class JsonLinesSink:
+    """
+    Append each stage record as one JSON line to a file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, record: dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+def _peak_rss_mb():
+    """
+    Peak resident set size of the process so far (ru_maxrss is KB on Linux, bytes on macOS).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def _rows(obj):
+
+    shape = getattr(obj, 'shape', None)
+    return int(shape[0]) if shape else None
+
+def get_sink():
+
+    return getattr(_state, 'sink', None)
+
+@contextmanager
+def instrument(sink, run_id=None, trace_memory=False):
+    """
+    Send a record for every instrumented stage run inside this block to sink.
+
+    Args:
+        sink (callable): Receives one dict per stage, e.g. MemorySink() or JsonLinesSink(path).
+        run_id (str): Optional label added to every record to tell production runs apart.
+        trace_memory (bool): Also start tracemalloc to report each stage's peak traced allocations.
+    """
+    previous = (get_sink(), getattr(_state, 'run_id', None), getattr(_state, 'stack', None))
+    _state.sink, _state.run_id, _state.stack = sink, run_id, []
+
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    try:
+        yield sink
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _state.sink, _state.run_id, _state.stack = previous
+
+@contextmanager
+def stage(name: str, rows_in=None):
+    """
+    Measure one pipeline stage: wall time, rows in and out, peak RSS and, when tracemalloc is
+    tracing, the peak of traced allocations. Does nothing unless an instrument() block is active.
+    Set info['rows_out'] on the yielded dict to report the stage's output size.
+    """
+    sink = get_sink()
+    info = {'rows_out': None}
+    if sink is None:
+        yield info
+        return
+
+    stack = _state.stack
+    tracing = tracemalloc.is_tracing()
+    frame = {'name': name, 'traced_start': 0, 'traced_peak': 0}
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        # The parent keeps the peak reached so far, this stage measures from here.
+        if stack:
+            stack[-1]['traced_peak'] = max(stack[-1]['traced_peak'], peak)
+        tracemalloc.reset_peak()
+        frame['traced_start'] = frame['traced_peak'] = current
+
+    parent = stack[-1]['name'] if stack else None
+    stack.append(frame)
+    rss_start = _peak_rss_mb()
+    started_at = time.time()
+    start = time.perf_counter()
+
+    try:
+        yield info
+    finally:
+        wall_s = time.perf_counter() - start
+        stack.pop()
+
+        traced_peak_mb = None
+        if tracing and tracemalloc.is_tracing():
+            _, peak = tracemalloc.get_traced_memory()
+            frame['traced_peak'] = max(frame['traced_peak'], peak)
+            traced_peak_mb = (frame['traced_peak'] - frame['traced_start']) / 2**20
+            if stack:
+                stack[-1]['traced_peak'] = max(stack[-1]['traced_peak'], frame['traced_peak'])
+
+        rss_peak = _peak_rss_mb()
+        sink({
+            'run_id': _state.run_id,
+            'stage': name,
+            'parent': parent,
+            'started_at': started_at,
+            'wall_s': wall_s,
+            'rows_in': rows_in,
+            'rows_out': info['rows_out'],
+            'rss_peak_mb': rss_peak,
+            'rss_peak_delta_mb': rss_peak - rss_start if rss_peak is not None else None,
+            'traced_peak_mb': traced_peak_mb
+        })
+
+def instrumented(name: str):
+    """
+    Decorator running a function as an instrumented stage. Rows in are taken from the first
+    positional argument and rows out from the result when they are DataFrames, Series or arrays.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if get_sink() is None:
+                return func(*args, **kwargs)
+
+            with stage(name, rows_in=_rows(args[0]) if args else None) as info:
+                result = func(*args, **kwargs)
+                info['rows_out'] = _rows(result)
+            return result
+        return wrapper
+    return decorator
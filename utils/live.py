@@ -0,0 +1,353 @@
+"""
+Live mode: keep the per-user allowance state current by tailing a newline-delimited event stream.
+
+Each event is folded into the state as it arrives, with the same rules as the batch
+update_allowance_backend_table: the latest event by event.timestamp (the later one on ties)
+sets frequency and day, updated_at is the latest event.timestamp and next_payment_day is the
+day of the next payment date. The state is snapshotted to disk together with the replay offset,
+so a restarted tail resumes from the snapshot and only replays the events after it.
+
+Run from the repository root:
+
+    python -m utils.live events.jsonl --snapshot live_state.json
+    producer | python -m utils.live - --snapshot live_state.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from collections import deque
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from utils.load_n_transform import parse_unix_or_date
+from utils.payment_schedule import CURRENT_DATE, get_next_payment_date, normalize_scheduled_day
+
+SNAPSHOT_VERSION = 1
+
+STATE_COLUMNS = ['frequency', 'day', 'next_payment_day', 'updated_at']
+
+
+# live allowance state     ----------------------------------------------------------------
+def _flatten(record: dict) -> dict:
+    """
+    Flatten one nested event (as in allowance_events.json) to the dotted column names of
+    get_allowance_events; already flat records are returned as they are.
+    """
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            for sub_key, sub_value in _flatten(value).items():
+                flat[f"{key}.{sub_key}"] = sub_value
+        else:
+            flat[key] = value
+    return flat
+
+def _next_payment_day(frequency, scheduled_day, current_date) -> float:
+    """
+    Day of month of the next payment date, NaN where the batch engine yields NaT.
+    """
+    try:
+        normalized_day = normalize_scheduled_day(frequency, scheduled_day)
+        return float(get_next_payment_date(frequency, normalized_day, current_date, current_date).day)
+    except (AttributeError, TypeError, ValueError):
+        return np.nan
+
+def _is_later(timestamp, latest) -> bool:
+    """
+    Event order of the batch update: a stable sort on event.timestamp with NaT last, keeping the last event.
+    """
+    if latest is None or pd.isna(timestamp):
+        return True
+    if pd.isna(latest):
+        return False
+    return timestamp >= latest
+
+class LiveState:
+    """
+    Per-user allowance state (frequency, day, next_payment_day, updated_at) updated one event at a time.
+
+    offset is the number of stream lines consumed and position the matching byte offset,
+    which is where a resumed tail continues reading.
+    """
+
+    def __init__(self, current_date=CURRENT_DATE, latency_window=10_000):
+        self.current_date = current_date
+        self.users = {}
+        self.offset = 0
+        self.position = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def apply(self, record: dict) -> dict:
+        """
+        Fold one event into the state and return the user's state after it (None for events without user.id).
+        """
+        event = _flatten(record)
+        uuid = event.get('user.id')
+        if uuid is None:
+            return None
+
+        timestamp = parse_unix_or_date(event.get('event.timestamp'))
+        state = self.users.get(uuid)
+
+        if state is None or _is_later(timestamp, state['_latest']):
+            frequency = event.get('allowance.scheduled.frequency')
+            day = event.get('allowance.scheduled.day')
+            state = {
+                'frequency': frequency,
+                'day': day,
+                'next_payment_day': _next_payment_day(frequency, day, self.current_date),
+                'updated_at': state['updated_at'] if state is not None else pd.NaT,
+                '_latest': timestamp
+            }
+            self.users[uuid] = state
+
+        # updated_at is the max event.timestamp, NaT only when every event lacks one
+        if pd.notna(timestamp) and (pd.isna(state['updated_at']) or timestamp > state['updated_at']):
+            state['updated_at'] = timestamp
+
+        return state
+
+    def refresh(self, current_date):
+        """
+        Move the state to a new current date, recomputing every next_payment_day.
+        """
+        self.current_date = current_date
+        for state in self.users.values():
+            state['next_payment_day'] = _next_payment_day(state['frequency'], state['day'], current_date)
+
+    def latency_summary(self) -> dict:
+        """
+        Per-event processing latency over the last latency_window events, in milliseconds.
+        """
+        if not self.latencies:
+            return {'events': 0, 'mean_ms': None, 'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+
+        latencies = np.fromiter(self.latencies, dtype=float) * 1e3
+        return {
+            'events': len(latencies),
+            'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'max_ms': float(latencies.max())
+        }
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The state as a DataFrame indexed by uuid, with the columns update_allowance_backend_table updates.
+        """
+        frame = pd.DataFrame.from_dict(self.users, orient='index', columns=STATE_COLUMNS)
+        frame.index.name = 'uuid'
+        frame['next_payment_day'] = frame['next_payment_day'].astype(float)
+        frame['updated_at'] = pd.to_datetime(frame['updated_at'])
+        return frame
+
+    def apply_to(self, allowance_backend_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Return a copy of the allowance backend table with the live state of every known user applied.
+        """
+        frame = self.to_frame()
+        positions = frame.index.get_indexer(allowance_backend_df['uuid'])
+        known = positions >= 0
+
+        updated_df = allowance_backend_df.copy()
+        for col in STATE_COLUMNS:
+            values = updated_df[col].to_numpy(dtype=object).copy()
+            values[known] = frame[col].to_numpy(dtype=object)[positions[known]]
+            updated_df[col] = values
+
+        return updated_df.infer_objects()
+
+    # snapshots --------------------------------------------------------------------------
+    def save(self, path: str):
+        """
+        Write the state and replay offset to path atomically (temporary file, then rename).
+        """
+        def encode(value):
+            if value is None or (isinstance(value, float) and math.isnan(value)) or value is pd.NaT:
+                return None
+            if isinstance(value, pd.Timestamp):
+                return value.isoformat()
+            return value
+
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'current_date': self.current_date.isoformat(),
+            'offset': self.offset,
+            'position': self.position,
+            'users': {uuid: {key: encode(value) for key, value in state.items()} for uuid, state in self.users.items()}
+        }
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, latency_window=10_000):
+        """
+        Restore a state saved with save().
+        """
+        with open(path) as f:
+            snapshot = json.load(f)
+
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported live snapshot version: {snapshot.get('version')}")
+
+        live = cls(date.fromisoformat(snapshot['current_date']), latency_window=latency_window)
+        live.offset = snapshot['offset']
+        live.position = snapshot['position']
+
+        for uuid, state in snapshot['users'].items():
+            live.users[uuid] = {
+                'frequency': state['frequency'],
+                'day': state['day'],
+                'next_payment_day': np.nan if state['next_payment_day'] is None else state['next_payment_day'],
+                'updated_at': pd.Timestamp(state['updated_at']) if state['updated_at'] else pd.NaT,
+                '_latest': pd.Timestamp(state['_latest']) if state['_latest'] else pd.NaT
+            }
+
+        return live
+
+# tail event stream        ----------------------------------------------------------------
+def _read_lines(stream, follow: bool, poll_interval: float, seekable: bool):
+    """
+    Yield complete lines from stream, waiting for more data at the end of a followed file.
+    A trailing line without a newline is only consumed once it is complete (or the stream ends).
+    """
+    pending = b''
+    while True:
+        chunk = stream.readline()
+        if chunk.endswith(b'\n'):
+            yield pending + chunk
+            pending = b''
+            continue
+
+        pending += chunk
+        if not follow or not seekable:
+            # Pipes and stdin end for good at EOF.
+            if not chunk:
+                if pending.strip():
+                    yield pending
+                return
+            continue
+
+        time.sleep(poll_interval)
+
+def tail_allowance_events(source, live=None, snapshot_path=None, snapshot_every=1_000, snapshot_interval=60.0,
+                          follow=True, poll_interval=1.0, current_date=CURRENT_DATE, report=None, max_events=None) -> LiveState:
+    """
+    Tail a newline-delimited stream of allowance events and keep the per-user state current.
+
+    When snapshot_path exists the state is restored from it and reading resumes at its replay
+    offset: files are seeked to the saved byte position, stdin skips the lines already consumed.
+    A snapshot is written every snapshot_every events or snapshot_interval seconds, and on exit.
+
+    Args:
+        source (str or file): Path to a JSON lines file, '-' for stdin, or a binary file object.
+        live (LiveState): State to continue from; defaults to the snapshot or a new state.
+        snapshot_path (str): Where to save (and restore) the state.
+        snapshot_every (int): Events between snapshots.
+        snapshot_interval (float): Seconds between snapshots while events keep arriving.
+        follow (bool): Keep waiting for new lines at the end of a file, like tail -f.
+        poll_interval (float): Seconds to wait at the end of a followed file.
+        current_date (date): Date the next payment dates are computed from; a restored state is refreshed to it.
+        report (callable): Called at every snapshot with the offset, user count and latency summary.
+        max_events (int): Stop after this many events (e.g. to catch up and exit).
+
+    Returns:
+        LiveState: The state after the last consumed event.
+    """
+    if live is None:
+        if snapshot_path and os.path.exists(snapshot_path):
+            live = LiveState.load(snapshot_path)
+            if live.current_date != current_date:
+                live.refresh(current_date)
+        else:
+            live = LiveState(current_date)
+
+    if source == '-':
+        stream, close = sys.stdin.buffer, False
+    elif isinstance(source, str):
+        stream, close = open(source, 'rb'), True
+    else:
+        stream, close = source, False
+
+    seekable = stream.seekable()
+    if seekable:
+        stream.seek(live.position)
+    else:
+        # Replay offset: lines already folded into the snapshot are skipped.
+        for _ in range(live.offset):
+            line = stream.readline()
+            if not line:
+                break
+            live.position += len(line)
+
+    def checkpoint():
+        if snapshot_path:
+            live.save(snapshot_path)
+        if report is not None:
+            report({'offset': live.offset, 'users': len(live), **live.latency_summary()})
+
+    processed = 0
+    last_snapshot = time.monotonic()
+    try:
+        for line in _read_lines(stream, follow, poll_interval, seekable):
+            start = time.perf_counter()
+            if line.strip():
+                live.apply(json.loads(line))
+            live.latencies.append(time.perf_counter() - start)
+
+            live.offset += 1
+            live.position += len(line)
+            processed += 1
+
+            if processed % snapshot_every == 0 or time.monotonic() - last_snapshot >= snapshot_interval:
+                checkpoint()
+                last_snapshot = time.monotonic()
+
+            if max_events is not None and processed >= max_events:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        checkpoint()
+        if close:
+            stream.close()
+
+    return live
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="JSON lines file of allowance events, or '-' for stdin")
+    parser.add_argument('--snapshot', help='state snapshot to resume from and write to')
+    parser.add_argument('--snapshot-every', type=int, default=1_000)
+    parser.add_argument('--snapshot-interval', type=float, default=60.0)
+    parser.add_argument('--no-follow', action='store_true', help='stop at the end of the file')
+    parser.add_argument('--current-date', type=date.fromisoformat, default=CURRENT_DATE)
+    args = parser.parse_args()
+
+    def report(summary):
+        print(json.dumps(summary), file=sys.stderr, flush=True)
+
+    tail_allowance_events(
+        args.source,
+        snapshot_path=args.snapshot,
+        snapshot_every=args.snapshot_every,
+        snapshot_interval=args.snapshot_interval,
+        follow=not args.no_follow,
+        current_date=args.current_date,
+        report=report
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,23 @@
 import json
+import numpy as np
 import pandas as pd
 
+from utils.cache import load_cached
+from utils.compact import compact_frame
+from utils.instrument import instrumented, stage
+
+# ISO strings ending in "Z" or a "+hh:mm" offset parse to tz-aware timestamps.
+TZ_SUFFIX_PATTERN = r'(?:Z|[+-]\d{2}:?\d{2})$'
+
+EVENT_COLUMNS = [
+    'user.id',
+    'event.timestamp',
+    'event.name',
+    'allowance.scheduled.frequency',
+    'allowance.scheduled.day',
+    'allowance.amount'
+]
+
 
 # load and transform data ----------------------------------------------------------------
 def parse_unix_or_date(val):
@@ -21,35 +38,268 @@ def parse_unix_or_date(val):
         # Otherwise, attempt to parse as a datetime string.
         return pd.to_datetime(val, errors='coerce', format='ISO8601')
 
-def get_allowance_backend_table(path='data/allowance_backend_table.csv'):
+@instrumented('load_n_transform.parse_unix_or_date_series')
+def parse_unix_or_date_series(values: pd.Series) -> pd.Series:
+    """
+    Vectorized parse_unix_or_date for a whole column.
+
+    Splits the column with masks into numeric epochs (numbers or digit-only strings),
+    naive ISO strings and tz-aware ISO strings, converts each group with a single
+    pd.to_datetime call and merges the results. Returns the same values, dtype and
+    coercion (unparseable strings become NaT) as values.apply(parse_unix_or_date).
+    """
+    values = pd.Series(values)
+
+    # Numeric columns are all Unix timestamps.
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return pd.to_datetime(values, unit='s')
+
+    if values.dtype != object:
+        return values.apply(parse_unix_or_date)
+
+    try:
+        is_str = values.str.len().notna().to_numpy()
+        is_digit = values.str.isdigit().eq(True).to_numpy()
+    except AttributeError:
+        # No strings at all in the column.
+        is_str = is_digit = np.zeros(len(values), dtype=bool)
+
+    is_number = np.zeros(len(values), dtype=bool)
+    if not is_str.all():
+        is_number[~is_str] = values[~is_str].map(lambda v: isinstance(v, (int, float))).to_numpy(dtype=bool)
+
+    is_aware = is_str & ~is_digit
+    if is_aware.any():
+        is_aware &= values.str.contains(TZ_SUFFIX_PATTERN, regex=True).eq(True).to_numpy()
+
+    is_naive = is_str & ~is_digit & ~is_aware
+    is_other = ~is_str & ~is_number
+
+    parts = []
+    if is_digit.any() or is_number.any():
+        epochs = values[is_digit | is_number]
+        parts.append(pd.to_datetime(pd.to_numeric(epochs), unit='s'))
+
+    for mask in (is_naive, is_aware):
+        if mask.any():
+            part = pd.to_datetime(values[mask], errors='coerce', format='ISO8601')
+            if mask is is_naive and part.dtype != 'datetime64[ns]':
+                # An offset the suffix pattern missed: fall back to parsing cell by cell.
+                part = values[mask].apply(parse_unix_or_date)
+            parts.append(part)
+
+    if is_other.any():
+        parts.append(values[is_other].apply(parse_unix_or_date))
+
+    if not parts:
+        return values.apply(parse_unix_or_date)
+
+    # A single datetime dtype can be merged as is; mixed naive/aware timestamps end up
+    # in an object column, exactly like the per-cell path.
+    if len({str(part.dtype) for part in parts}) == 1 and parts[0].dtype != object:
+        return pd.concat(parts).reindex(values.index)
 
-    allowance_backend_table = pd.read_csv(path)
+    merged = pd.Series(None, index=values.index, dtype=object)
+    for part in parts:
+        merged[part.index] = part.astype(object)
+    return merged.infer_objects()
+
+@instrumented('load_n_transform.get_allowance_backend_table')
+def get_allowance_backend_table(path='data/allowance_backend_table.csv', cache=False, compact=False):
+
+    # typed result cached next to the source
+    if cache:
+        name = 'allowance_backend_table.compact' if compact else 'allowance_backend_table'
+        return load_cached(path, name, lambda: get_allowance_backend_table(path, compact=compact))
+
+    with stage('load_n_transform.read_csv') as info:
+        allowance_backend_table = pd.read_csv(path)
+        info['rows_out'] = len(allowance_backend_table)
 
     # date adj
-    allowance_backend_table['creation_date'] = allowance_backend_table['creation_date'].apply(parse_unix_or_date)
-    allowance_backend_table['updated_at'] = allowance_backend_table['updated_at'].apply(parse_unix_or_date)
+    allowance_backend_table['creation_date'] = parse_unix_or_date_series(allowance_backend_table['creation_date'])
+    allowance_backend_table['updated_at'] = parse_unix_or_date_series(allowance_backend_table['updated_at'])
 
     allowance_backend_table = allowance_backend_table.sort_values(['creation_date'])
 
+    if compact:
+        allowance_backend_table = compact_frame(allowance_backend_table)
+
     return allowance_backend_table
 
-def get_payment_schedule_backend_table(path='data/payment_schedule_backend_table.csv'):
+def iter_allowance_backend_table(path='data/allowance_backend_table.csv', chunksize=100_000):
+    """
+    Read the allowance backend table in chunks of at most chunksize rows, with the same date
+    parsing as get_allowance_backend_table. Rows keep their file order (no creation_date sort).
+    """
+    for allowance_backend_table in pd.read_csv(path, chunksize=chunksize):
+
+        # date adj
+        allowance_backend_table['creation_date'] = parse_unix_or_date_series(allowance_backend_table['creation_date'])
+        allowance_backend_table['updated_at'] = parse_unix_or_date_series(allowance_backend_table['updated_at'])
+
+        yield allowance_backend_table
 
-    payment_schedule_backend_table = pd.read_csv(path)
+@instrumented('load_n_transform.get_payment_schedule_backend_table')
+def get_payment_schedule_backend_table(path='data/payment_schedule_backend_table.csv', cache=False, compact=False):
+
+    # typed result cached next to the source
+    if cache:
+        name = 'payment_schedule_backend_table.compact' if compact else 'payment_schedule_backend_table'
+        return load_cached(path, name, lambda: get_payment_schedule_backend_table(path, compact=compact))
+
+    with stage('load_n_transform.read_csv') as info:
+        payment_schedule_backend_table = pd.read_csv(path)
+        info['rows_out'] = len(payment_schedule_backend_table)
 
     # rename uuid column
     payment_schedule_backend_table.rename(columns={'user_id': 'uuid'}, inplace=True)
 
+    if compact:
+        payment_schedule_backend_table = compact_frame(payment_schedule_backend_table)
+
     return payment_schedule_backend_table
 
-def get_allowance_events(path='data/allowance_events.json'):
+def iter_payment_schedule_backend_table(path='data/payment_schedule_backend_table.csv', chunksize=100_000):
+    """
+    Read the payment schedule backend table in chunks of at most chunksize rows.
+    """
+    for payment_schedule_backend_table in pd.read_csv(path, chunksize=chunksize):
+
+        # rename uuid column
+        yield payment_schedule_backend_table.rename(columns={'user_id': 'uuid'})
 
-    with open(path) as f:
-        allowance_events_json = json.load(f)
+@instrumented('load_n_transform.get_allowance_events')
+def get_allowance_events(path='data/allowance_events.json', cache=False, compact=False):
+
+    # typed result cached next to the source
+    if cache:
+        name = 'allowance_events.compact' if compact else 'allowance_events'
+        return load_cached(path, name, lambda: get_allowance_events(path, compact=compact))
 
-    allowance_events = pd.json_normalize(allowance_events_json)
+    with stage('load_n_transform.read_json') as info:
+        with open(path) as f:
+            allowance_events_json = json.load(f)
+
+        allowance_events = pd.json_normalize(allowance_events_json)
+        info['rows_out'] = len(allowance_events)
 
     # date adj
-    allowance_events['event.timestamp'] = allowance_events['event.timestamp'].apply(parse_unix_or_date)
+    allowance_events['event.timestamp'] = parse_unix_or_date_series(allowance_events['event.timestamp'])
+
+    if compact:
+        allowance_events = compact_frame(allowance_events)
 
     return allowance_events
+
+def _iter_json_array(f, buffer_size=1 << 20):
+    """
+    Yield the elements of a top-level JSON array one at a time,
+    reading the file in buffer_size blocks instead of loading it whole.
+    """
+    decoder = json.JSONDecoder()
+    buf = f.read(buffer_size)
+    pos = 0
+    started = False
+
+    while True:
+        # Skip whitespace and separators, refilling the buffer when it runs out.
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+            pos += 1
+
+        if pos == len(buf):
+            chunk = f.read(buffer_size)
+            if not chunk:
+                raise ValueError("Unexpected end of file while reading JSON array")
+            buf, pos = chunk, 0
+            continue
+
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError("Expected a JSON array of events")
+            started = True
+            pos += 1
+            continue
+
+        if buf[pos] == ']':
+            return
+
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The record is cut by the end of the buffer: append the next block and retry.
+            chunk = f.read(buffer_size)
+            if not chunk:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+
+        yield record
+        pos = end
+
+def _iter_json_lines(f):
+    """
+    Yield one record per non-blank line of a newline-delimited JSON file.
+    """
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def _is_json_lines(f) -> bool:
+    """
+    Peek at the first non-whitespace character: a JSON array starts with '[',
+    anything else is treated as newline-delimited JSON.
+    """
+    start = f.tell()
+    char = f.read(1)
+    while char and char.isspace():
+        char = f.read(1)
+    f.seek(start)
+    return char != '['
+
+def _events_frame(records, start: int) -> pd.DataFrame:
+
+    events = pd.json_normalize(records)
+    events.index = pd.RangeIndex(start, start + len(events))
+
+    for col in EVENT_COLUMNS:
+        if col not in events.columns:
+            events[col] = None
+
+    # date adj
+    events['event.timestamp'] = parse_unix_or_date_series(events['event.timestamp'])
+
+    return events
+
+def iter_allowance_events(path='data/allowance_events.json', chunksize=100_000, lines=None):
+    """
+    Incrementally load the allowance events, yielding flattened DataFrame chunks of at most
+    chunksize events with the same columns as get_allowance_events. Records are parsed one
+    by one, so peak memory depends on chunksize rather than on the file size.
+
+    Args:
+        path (str): Path to a JSON array of events or to newline-delimited JSON.
+        chunksize (int): Maximum number of events per yielded DataFrame.
+        lines (bool): True for newline-delimited JSON, False for a JSON array,
+                      None to detect the format from the file contents.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of events, indexed by their position in the file.
+    """
+    with open(path) as f:
+        if lines is None:
+            lines = _is_json_lines(f)
+
+        records = _iter_json_lines(f) if lines else _iter_json_array(f)
+
+        batch = []
+        start = 0
+        for record in records:
+            batch.append(record)
+            if len(batch) == chunksize:
+                yield _events_frame(batch, start)
+                start += len(batch)
+                batch = []
+
+        if batch:
+            yield _events_frame(batch, start)
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from utils.instrument import instrumented
+from utils.payment_schedule import (
+    CURRENT_DATE,
+    biweekly_occurrences,
+    get_latest_events,
+    get_next_payment_dates,
+    normalize_scheduled_days
+)
+
+
+# materialize payment calendar ------------------------------------------------------------
+def _months(first: np.datetime64, last: np.datetime64) -> np.ndarray:
+
+    return np.arange(first.astype('datetime64[M]'), last.astype('datetime64[M]') + 1)
+
+def schedule_occurrences(frequency: str, scheduled_day, start_date=CURRENT_DATE, end_date=None) -> np.ndarray:
+    """
+    Every payment date of one (frequency, normalized scheduled day) in (start_date, end_date].
+
+    The first date is get_next_payment_date's answer at start_date; each following date is its
+    answer again from the previous payment: every day, every 7 days, the 1st and 3rd weekday of
+    each month, or the scheduled day of each month clamped to the month's last day.
+    """
+    start = np.datetime64(start_date, 'D')
+    end = np.datetime64(end_date, 'D')
+    first = get_next_payment_dates([frequency], [scheduled_day], start, start)[0]
+    freq = frequency.lower()
+
+    if np.isnat(first) or first > end:
+        return np.array([], dtype='datetime64[D]')
+
+    if freq == "daily":
+        return np.arange(first, end + 1)
+
+    if freq == "weekly":
+        return np.arange(first, end + 1, 7)
+
+    if freq == "biweekly":
+        weekday = first.astype(object).weekday()
+        dates = np.array([
+            occurrence
+            for month in _months(first, end).astype(object)
+            for occurrence in biweekly_occurrences(month.year, month.month, weekday)
+        ], dtype='datetime64[D]')
+        return dates[(dates >= first) & (dates <= end)]
+
+    # monthly: after the first payment, every month on min(day, last day of the month)
+    months = _months(first, end)[1:]
+    month_days = months.astype('datetime64[D]')
+    last_days = ((months + 1).astype('datetime64[D]') - month_days).astype(np.int64)
+    offsets = np.minimum(int(scheduled_day), last_days) - 1
+    dates = np.r_[first, month_days + offsets.astype('timedelta64[D]')]
+    return dates[dates <= end]
+
+def _schedule_groups(allowance_backend_df: pd.DataFrame, allowance_events: pd.DataFrame, only_enabled: bool) -> pd.DataFrame:
+    """
+    One row per allowance with its uuid, amount (from its latest event) and (frequency, normalized day) key.
+    """
+    if only_enabled:
+        allowance_backend_df = allowance_backend_df[allowance_backend_df['status'] == "enabled"]
+
+    amounts = get_latest_events(allowance_events)['allowance.amount']
+
+    return pd.DataFrame({
+        'uuid': allowance_backend_df['uuid'].to_numpy(),
+        'amount': amounts.reindex(allowance_backend_df['uuid']).to_numpy(),
+        'frequency': allowance_backend_df['frequency'].str.lower().to_numpy(),
+        'normalized_day': normalize_scheduled_days(allowance_backend_df['frequency'], allowance_backend_df['day']).to_numpy()
+    })
+
+def _horizon_end(start_date, months: int):
+
+    return start_date + relativedelta(months=months)
+
+@instrumented('payment_calendar.materialize_payment_calendar')
+def materialize_payment_calendar(allowance_backend_df: pd.DataFrame, allowance_events: pd.DataFrame, months=3,
+                                 start_date=CURRENT_DATE, only_enabled=True) -> pd.DataFrame:
+    """
+    Materialize every payment of every allowance over the next months.
+
+    Payment dates only depend on the (frequency, scheduled day) pair, so the dates are generated
+    once per distinct pair and then repeated for all allowances sharing it.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): The (updated) allowance backend table.
+        allowance_events (pd.DataFrame): The allowance events; the latest event of each user gives the amount.
+        months (int): Horizon in months after start_date.
+        start_date (date): Payments strictly after this date are generated.
+        only_enabled (bool): Only schedule enabled allowances.
+
+    Returns:
+        pd.DataFrame: One row per payment with columns 'uuid', 'payment_date', 'amount',
+                    ordered by payment_date and uuid.
+    """
+    end_date = _horizon_end(start_date, months)
+    groups = _schedule_groups(allowance_backend_df, allowance_events, only_enabled)
+
+    frames = []
+    for (frequency, normalized_day), group in groups.groupby(['frequency', 'normalized_day'], sort=False, observed=True):
+        dates = schedule_occurrences(frequency, normalized_day, start_date, end_date)
+        frames.append(pd.DataFrame({
+            'uuid': np.repeat(group['uuid'].to_numpy(), len(dates)),
+            'payment_date': np.tile(dates, len(group)).astype('datetime64[ns]'),
+            'amount': np.repeat(group['amount'].to_numpy(), len(dates))
+        }))
+
+    if not frames:
+        return pd.DataFrame({'uuid': [], 'payment_date': pd.Series([], dtype='datetime64[ns]'), 'amount': []})
+
+    calendar = pd.concat(frames, ignore_index=True)
+    return calendar.sort_values(['payment_date', 'uuid'], kind='stable').reset_index(drop=True)
+
+@instrumented('payment_calendar.payment_calendar_daily_totals')
+def payment_calendar_daily_totals(allowance_backend_df: pd.DataFrame, allowance_events: pd.DataFrame, months=3,
+                                  start_date=CURRENT_DATE, only_enabled=True) -> pd.DataFrame:
+    """
+    Daily cash outflow of materialize_payment_calendar, without building the per-payment rows:
+    amounts are summed per (frequency, scheduled day) pair first and then spread over its dates.
+
+    Returns:
+        pd.DataFrame: One row per day of the horizon with columns 'payment_date', 'amount', 'payments'.
+    """
+    end_date = _horizon_end(start_date, months)
+    groups = _schedule_groups(allowance_backend_df, allowance_events, only_enabled)
+    totals = groups.groupby(['frequency', 'normalized_day'], sort=False, observed=True)['amount'].agg(['sum', 'size'])
+
+    frames = []
+    for (frequency, normalized_day), total in totals.iterrows():
+        dates = schedule_occurrences(frequency, normalized_day, start_date, end_date)
+        frames.append(pd.DataFrame({'payment_date': dates, 'amount': total['sum'], 'payments': total['size']}))
+
+    days = pd.date_range(pd.Timestamp(start_date) + pd.Timedelta(days=1), pd.Timestamp(end_date), name='payment_date')
+    if not frames:
+        return pd.DataFrame({'payment_date': days, 'amount': 0.0, 'payments': 0})
+
+    daily = pd.concat(frames, ignore_index=True)
+    daily['payment_date'] = daily['payment_date'].astype('datetime64[ns]')
+    daily = daily.groupby('payment_date')[['amount', 'payments']].sum().reindex(days, fill_value=0)
+    daily['payments'] = daily['payments'].astype(np.int64)
+    return daily.reset_index()
@@ -1,10 +1,25 @@
 import calendar
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta
+from functools import lru_cache
 from dateutil.relativedelta import relativedelta
 
+from utils.compact import compact_frame, is_compact
+from utils.instrument import instrumented
+
 CURRENT_DATE = date(2024, 12, 3)
 
+DAY_MAPPING = {
+    "monday": 0,
+    "tuesday": 1,
+    "wednesday": 2,
+    "thursday": 3,
+    "friday": 4,
+    "saturday": 5,
+    "sunday": 6
+}
+
 
 # generate payment schedule ----------------------------------------------------------------
 def normalize_scheduled_day(frequency: str, scheduled_day: str):
@@ -39,6 +54,16 @@ def normalize_scheduled_day(frequency: str, scheduled_day: str):
     else:
         raise ValueError(f"Unsupported frequency: {frequency}")
 
+@lru_cache(maxsize=None)
+def biweekly_occurrences(year: int, month: int, weekday: int) -> tuple:
+    """
+    Return the first and third occurrence of weekday (monday=0) in the given year/month.
+    Results are memoized, so each (year, month, weekday) is only computed once.
+    """
+    first_weekday, _ = calendar.monthrange(year, month)
+    first = 1 + (weekday - first_weekday) % 7
+    return date(year, month, first), date(year, month, first + 14)
+
 def get_next_payment_date(frequency: str, scheduled_day, base_date: date, current_date=CURRENT_DATE) -> date:
     """
     Compute the next payment date based on the allowance frequency and scheduled day.
@@ -56,16 +81,7 @@ def get_next_payment_date(frequency: str, scheduled_day, base_date: date, curren
     
     elif freq == "weekly":
         # Use the standard weekly logic.
-        day_mapping = {
-            "monday": 0,
-            "tuesday": 1,
-            "wednesday": 2,
-            "thursday": 3,
-            "friday": 4,
-            "saturday": 5,
-            "sunday": 6
-        }
-        target_weekday = day_mapping.get(scheduled_day.lower())
+        target_weekday = DAY_MAPPING.get(scheduled_day.lower())
         if target_weekday is None:
             raise ValueError(f"Invalid scheduled_day for weekly: {scheduled_day}")
         days_ahead = (target_weekday - base_date.weekday() + 7) % 7
@@ -75,49 +91,19 @@ def get_next_payment_date(frequency: str, scheduled_day, base_date: date, curren
     
     elif freq == "biweekly":
         # Biweekly: Payment only on the first and third occurrence of scheduled_day in the month.
-        day_mapping = {
-            "monday": 0,
-            "tuesday": 1,
-            "wednesday": 2,
-            "thursday": 3,
-            "friday": 4,
-            "saturday": 5,
-            "sunday": 6
-        }
-        target_weekday = day_mapping.get(scheduled_day.lower())
+        target_weekday = DAY_MAPPING.get(scheduled_day.lower())
         if target_weekday is None:
             raise ValueError(f"Invalid scheduled_day for biweekly: {scheduled_day}")
         
-        # Define a helper to find the valid (1st and 3rd) occurrences in a given year/month.
-        def valid_biweekly_dates(year: int, month: int):
-            _, num_days = calendar.monthrange(year, month)
-            weekday_dates = [date(year, month, d) for d in range(1, num_days + 1)
-                             if date(year, month, d).weekday() == target_weekday]
-            valid = []
-            if len(weekday_dates) >= 1:
-                valid.append(weekday_dates[0])  # first occurrence
-
-            if len(weekday_dates) >= 3:
-                valid.append(weekday_dates[2])  # third occurrence
-
-            return valid
-        
         # Check current month.
         year, month = current_date.year, current_date.month
-        valid_dates = valid_biweekly_dates(year, month)
-        for dt in valid_dates:
+        for dt in biweekly_occurrences(year, month, target_weekday):
             if dt > current_date:
                 return dt
         
         # If none found in the current month, move to the next month.
-        next_month_date = current_date + relativedelta(months=1)
-        year, month = next_month_date.year, next_month_date.month
-        valid_dates = valid_biweekly_dates(year, month)
-        if valid_dates:
-            return valid_dates[0]
-        
-        else:
-            raise ValueError("No valid biweekly payment date found in the next month.")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return biweekly_occurrences(year, month, target_weekday)[0]
     
     elif freq == "monthly":
         # For monthly frequency, scheduled_day is expected to be an integer.
@@ -135,6 +121,243 @@ def get_next_payment_date(frequency: str, scheduled_day, base_date: date, curren
     else:
         raise ValueError(f"Unsupported frequency: {frequency}")
 
+def _to_days(values, size: int) -> np.ndarray:
+    """
+    Broadcast dates (date, Timestamp, datetime64 or array-likes of them) to a datetime64[D] array.
+    """
+    days = np.asarray(values, dtype='datetime64[D]')
+    return np.broadcast_to(days, (size,)) if days.ndim == 0 else days
+
+def _weekday(days: np.ndarray) -> np.ndarray:
+    """
+    Weekday (monday=0) of a datetime64[D] array; 1970-01-01 was a thursday.
+    """
+    return (days.astype(np.int64) + 3) % 7
+
+def _biweekly_calendar(months: np.ndarray, weekdays: np.ndarray) -> tuple:
+    """
+    Look up the first and third occurrences for datetime64[M] months and weekdays
+    through the memoized biweekly_occurrences, once per distinct (month, weekday).
+    """
+    keys = months.astype(np.int64) * 7 + weekdays
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    table = np.array(
+        [biweekly_occurrences(1970 + int(k) // 84, int(k) // 7 % 12 + 1, int(k) % 7) for k in unique_keys],
+        dtype='datetime64[D]'
+    ).reshape(-1, 2)
+    return table[inverse, 0], table[inverse, 1]
+
+@instrumented('payment_schedule.get_next_payment_dates')
+def get_next_payment_dates(frequencies, scheduled_days, base_dates, current_date=CURRENT_DATE) -> np.ndarray:
+    """
+    Batch version of get_next_payment_date.
+
+    Takes arrays (or Series) of frequencies, normalized scheduled days (as returned by
+    normalize_scheduled_day) and base dates, and computes every next payment date in one
+    pass using NumPy datetime64 arithmetic. base_dates and current_date may also be scalars.
+
+    Rows for which get_next_payment_date would raise (unsupported frequency, invalid weekday
+    or monthly day) are returned as NaT.
+
+    Args:
+        frequencies (array-like): Allowance frequencies (daily, weekly, biweekly or monthly).
+        scheduled_days (array-like): Normalized scheduled days (weekday names or day-of-month ints).
+        base_dates (array-like or date): Reference dates for weekly and monthly rules.
+        current_date (array-like or date): Reference dates for daily and biweekly rules.
+
+    Returns:
+        np.ndarray: The next payment dates as a datetime64[D] array.
+    """
+    freq = pd.Series(np.asarray(frequencies, dtype=object)).astype(str).str.lower().to_numpy()
+    days = pd.Series(np.asarray(scheduled_days, dtype=object))
+    size = len(freq)
+
+    base = _to_days(base_dates, size)
+    current = _to_days(current_date, size)
+
+    result = np.full(size, np.datetime64('NaT'), dtype='datetime64[D]')
+    one_day = np.timedelta64(1, 'D')
+
+    # daily: the day after current_date
+    is_daily = freq == "daily"
+    result[is_daily] = current[is_daily] + one_day
+
+    # weekly and biweekly: map weekday names, invalid names stay NaT
+    target_weekday = days.astype(str).str.lower().map(DAY_MAPPING).to_numpy(dtype=float)
+    has_weekday = ~np.isnan(target_weekday)
+    target_weekday = np.nan_to_num(target_weekday).astype(np.int64)
+
+    is_weekly = (freq == "weekly") & has_weekday
+    days_ahead = (target_weekday - _weekday(base) + 7) % 7
+    days_ahead[days_ahead == 0] = 7
+    result[is_weekly] = base[is_weekly] + days_ahead[is_weekly].astype('timedelta64[D]')
+
+    # biweekly: first and third occurrence of the weekday in current_date's month, else the next month's first
+    is_biweekly = (freq == "biweekly") & has_weekday
+    current_bw = current[is_biweekly]
+    weekday_bw = target_weekday[is_biweekly]
+    first, third = _biweekly_calendar(current_bw.astype('datetime64[M]'), weekday_bw)
+    first_next, _ = _biweekly_calendar(current_bw.astype('datetime64[M]') + 1, weekday_bw)
+    result[is_biweekly] = np.where(first > current_bw, first, np.where(third > current_bw, third, first_next))
+
+    # monthly: the day in base_date's month if still ahead, else next month clamped to its last day
+    day_num = pd.to_numeric(days, errors='coerce').to_numpy(dtype=float)
+    is_monthly = (freq == "monthly") & (day_num >= 1)
+    day_num = np.nan_to_num(day_num).astype(np.int64)
+
+    base_month = base.astype('datetime64[M]')
+    base_day = (base - base_month.astype('datetime64[D]')).astype(np.int64) + 1
+    last_day = ((base_month + 1).astype('datetime64[D]') - base_month.astype('datetime64[D]')).astype(np.int64)
+    last_day_next = ((base_month + 2).astype('datetime64[D]') - (base_month + 1).astype('datetime64[D]')).astype(np.int64)
+
+    this_month = (base_day < day_num) & (day_num <= last_day)
+    month = np.where(this_month, base_month, base_month + 1)
+    day_to_use = np.where(this_month, day_num, np.minimum(day_num, last_day_next))
+    monthly = month.astype('datetime64[D]') + (day_to_use - 1).astype('timedelta64[D]')
+    result[is_monthly] = monthly[is_monthly]
+
+    return result
+
+def normalize_scheduled_days(frequencies, scheduled_days) -> pd.Series:
+    """
+    Batch version of normalize_scheduled_day.
+    Each distinct (frequency, scheduled_day) pair is normalized once and mapped back to every row.
+    """
+    pairs = pd.DataFrame({
+        'frequency': np.asarray(frequencies, dtype=object),
+        'day': np.asarray(scheduled_days, dtype=object)
+    })
+    unique_pairs = pairs.drop_duplicates().copy()
+    unique_pairs['normalized'] = [
+        normalize_scheduled_day(frequency, day) for frequency, day in zip(unique_pairs['frequency'], unique_pairs['day'])
+    ]
+    return pairs.merge(unique_pairs, on=['frequency', 'day'], how='left')['normalized']
+
+@instrumented('payment_schedule.get_latest_events')
+def get_latest_events(events_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the latest event of each user, indexed by user.id, using one global stable sort
+    on (user.id, event.timestamp). An 'updated_at' column holds each user's max event.timestamp.
+    """
+    events = events_df[events_df['user.id'].notna()]
+    events = events.sort_values(['user.id', 'event.timestamp'], kind='stable')
+
+    latest = events.drop_duplicates('user.id', keep='last').set_index('user.id')
+    latest['updated_at'] = events.groupby('user.id', observed=True)['event.timestamp'].max()
+
+    return latest
+
+class LatestEvents:
+    """
+    get_latest_events over a stream of event chunks: each chunk's get_latest_events result is
+    folded in with update(), as if get_latest_events had been run on all the chunks at once
+    (on equal timestamps the later chunk wins, NaT timestamps sort last and updated_at is the
+    max over every chunk).
+
+    Only the users of the chunk are looked up and updated in place (a dict of row positions
+    and column arrays grown by doubling), so the total work is proportional to the number of
+    events rather than to the number of chunks times the number of users.
+    """
+
+    def __init__(self):
+        self.positions = {}
+        self.columns = {}
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def update(self, latest: pd.DataFrame):
+        """
+        Fold the get_latest_events result of the next chunk of events into the state.
+        """
+        if not self.columns:
+            self.columns = {col: latest[col].to_numpy()[:0] for col in latest.columns}
+
+        uuids = latest.index.to_numpy(dtype=object)
+        get = self.positions.get
+        positions = np.fromiter((get(uuid, -1) for uuid in uuids), dtype=np.int64, count=len(uuids))
+        known = positions >= 0
+
+        # known users: the chunk's latest event replaces the stored one unless it is older
+        rows = positions[known]
+        timestamps = latest['event.timestamp'].to_numpy()[known]
+        stored = self.columns['event.timestamp'][rows]
+        later = pd.isna(timestamps) | (pd.notna(stored) & (timestamps >= stored))
+
+        updated_at = latest['updated_at'].to_numpy()[known]
+        stored_updated_at = self.columns['updated_at'][rows]
+        updated_at = np.where(pd.isna(stored_updated_at) | (updated_at > stored_updated_at), updated_at, stored_updated_at)
+
+        for col, values in self.columns.items():
+            if col == 'updated_at':
+                values[rows] = updated_at
+            else:
+                values[rows[later]] = latest[col].to_numpy()[known][later]
+
+        # new users are appended
+        new = np.flatnonzero(~known)
+        self._reserve(len(new))
+        for col, values in self.columns.items():
+            values[self.size:self.size + len(new)] = latest[col].to_numpy()[new]
+        self.positions.update(zip(uuids[new], range(self.size, self.size + len(new))))
+        self.size += len(new)
+
+    def _reserve(self, n: int):
+
+        capacity = len(self.columns['updated_at'])
+        if self.size + n <= capacity:
+            return
+
+        capacity = max(2 * capacity, self.size + n)
+        for col, values in self.columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self.columns[col] = grown
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        The latest event of each user, indexed by user.id, as get_latest_events returns it.
+        """
+        index = pd.Index(np.fromiter(self.positions, dtype=object, count=self.size), name='user.id')
+        frame = pd.DataFrame({col: values[:self.size] for col, values in self.columns.items()}, index=index)
+        return frame.sort_index(kind='stable')
+
+def get_allowance_state(latest: pd.DataFrame) -> pd.DataFrame:
+    """
+    The fields update_allowance_backend_table sets, per user, from get_latest_events output:
+    frequency, day, next_payment_day (day of the expected next payment date) and updated_at.
+    """
+    frequency = latest['allowance.scheduled.frequency']
+    raw_day = latest['allowance.scheduled.day']
+    normalized_day = normalize_scheduled_days(frequency, raw_day)
+    expected_date = get_next_payment_dates(frequency, normalized_day, CURRENT_DATE)
+
+    next_payment_day = pd.Series(expected_date).dt.day.astype(float).to_numpy()
+    return pd.DataFrame({
+        'frequency': frequency.to_numpy(),
+        'day': raw_day.to_numpy(),
+        'next_payment_day': next_payment_day,
+        'updated_at': latest['updated_at'].to_numpy()
+    }, index=latest.index)
+
+def apply_allowance_state(original_df: pd.DataFrame, computed: pd.DataFrame) -> pd.DataFrame:
+    """
+    Update the rows of original_df whose uuid has a computed state, keeping the original row order and index.
+    """
+    positions = computed.index.get_indexer(original_df['uuid'])
+    has_events = positions >= 0
+    matched = computed.iloc[positions[has_events]]
+
+    updated_df = original_df.copy()
+    for col in computed.columns:
+        values = updated_df[col].to_numpy(dtype=object).copy()
+        values[has_events] = matched[col].to_numpy(dtype=object)
+        updated_df[col] = values
+
+    return updated_df.infer_objects()
+
+@instrumented('payment_schedule.update_allowance_backend_table')
 def update_allowance_backend_table(original_df: pd.DataFrame, events_df: pd.DataFrame) -> pd.DataFrame:
     """
     Update the original allowance_backend_table using the events log.
@@ -144,47 +367,26 @@ def update_allowance_backend_table(original_df: pd.DataFrame, events_df: pd.Data
         - updated_at
         - next_payment_day (computed from the expected next payment date)
     The original uuid, creation_date, and status fields remain unchanged.
+
+    The latest events are selected with one global sort, their next payment dates are computed
+    in a single batch and the results are joined onto the backend table on uuid.
     """
     # Ensure event.timestamp is in datetime format.
     events_df['event.timestamp'] = pd.to_datetime(events_df['event.timestamp'])
-    
+
     # Compute the latest settings per user from events.
-    computed = {}
-    grouped = events_df.groupby('user.id')
-    for user_id, group in grouped:
-        # Latest event for this user
-        latest_event = group.sort_values('event.timestamp').iloc[-1]
-        frequency = latest_event['allowance.scheduled.frequency']
-        raw_day = latest_event['allowance.scheduled.day']
-        normalized_day = normalize_scheduled_day(frequency, raw_day)
-
-        try:
-            expected_date = get_next_payment_date(frequency, normalized_day, CURRENT_DATE)
-
-        except Exception as e:
-            expected_date = None
-
-        updated_at = group['event.timestamp'].max()
-        computed[user_id] = {
-            'frequency': frequency,
-            'day': raw_day,
-            'next_payment_day': float(expected_date.day) if expected_date is not None else None,
-            'updated_at': updated_at
-        }
-    
-    # Update original rows where computed events exist.
-    updated_rows = []
-    for idx, row in original_df.iterrows():
-        user_id = row['uuid']
-        if user_id in computed:
-            row['frequency'] = computed[user_id]['frequency']
-            row['day'] = computed[user_id]['day']
-            row['next_payment_day'] = computed[user_id]['next_payment_day']
-            row['updated_at'] = computed[user_id]['updated_at']
-        updated_rows.append(row)
-
-    return pd.DataFrame(updated_rows)
+    computed = get_allowance_state(get_latest_events(events_df))
+
+    # Update original rows where computed events exist, keeping the original row order and index.
+    updated_df = apply_allowance_state(original_df, computed)
+
+    # Keep compact inputs compact.
+    if is_compact(original_df):
+        updated_df = compact_frame(updated_df)
+
+    return updated_df
 
+@instrumented('payment_schedule.generate_payment_schedule_backend_table')
 def generate_payment_schedule_backend_table(allowance_backend_df: pd.DataFrame, only_enabled=True) -> pd.DataFrame:
     """
     For enabled allowances, generate the payment schedule record.
@@ -193,18 +395,68 @@ def generate_payment_schedule_backend_table(allowance_backend_df: pd.DataFrame,
 
     if only_enabled:
         allowance_backend_df = allowance_backend_df[allowance_backend_df['status'] == "enabled"]
-        
-    records = []
-    for _, row in allowance_backend_df.iterrows():
-        record = {
-            "uuid": row['uuid'],
-            "payment_date": row['next_payment_day']  # this is the day-of-month (float)
-        }
-        records.append(record)
-    return pd.DataFrame(records)
+
+    # payment_date is the day-of-month of next_payment_day; column dtypes (compact ones included) are kept
+    return pd.DataFrame({
+        "uuid": allowance_backend_df['uuid'].to_numpy(),
+        "payment_date": allowance_backend_df['next_payment_day'].array
+    }, index=pd.RangeIndex(len(allowance_backend_df)))
+
+class EventsIndex:
+    """
+    Per-user index over the allowance events, built once and queried many times.
+
+    The events are sorted by (user.id, event.timestamp) and each user's rows are recorded
+    as an offset range, so one user's timeline is a single O(1) slice.
+    """
+
+    def __init__(self, allowance_events: pd.DataFrame):
+        events = allowance_events[allowance_events['user.id'].notna()]
+        self.events = events.sort_values(['user.id', 'event.timestamp'], kind='stable')
+
+        users = self.events['user.id'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.array([], dtype=np.int64)
+
+        self.users = pd.Index(users[starts])
+        self.starts = starts
+        self.ends = np.r_[starts[1:], len(users)].astype(np.int64)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __contains__(self, uuid) -> bool:
+        return uuid in self.users
+
+    def get(self, uuid) -> pd.DataFrame:
+        """
+        Return the events of one user ordered by event.timestamp (empty if the user has none).
+        """
+        if uuid not in self.users:
+            return self.events.iloc[:0]
+
+        loc = self.users.get_loc(uuid)
+        return self.events.iloc[self.starts[loc]:self.ends[loc]]
+
+    def get_many(self, uuids) -> pd.DataFrame:
+        """
+        Return the events of many users at once, grouped in the order of uuids and
+        ordered by event.timestamp within each user. Unknown uuids are skipped.
+        """
+        locs = self.users.get_indexer(pd.Index(uuids))
+        locs = locs[locs >= 0]
+
+        starts = self.starts[locs]
+        lengths = self.ends[locs] - starts
+        # Expand every [start, end) range into row positions without a Python loop.
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.events.iloc[np.repeat(starts, lengths) + offsets]
 
 def get_events_logs(allowance_events, uuid) -> pd.DataFrame:
 
+    # Prebuilt indexes answer with a slice instead of scanning every event.
+    if isinstance(allowance_events, EventsIndex):
+        return allowance_events.get(uuid)
+
     user_events = allowance_events[allowance_events['user.id'] == uuid]
     user_events = user_events.sort_values('event.timestamp')
     
@@ -1,24 +1,114 @@
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 
+# pre-aggregated statistics ----------------------------------------------------------------
+def value_counts_of(values) -> pd.Series:
+    """
+    Count of each distinct value, sorted by value, NaN dropped. Small non-negative integers
+    (e.g. days of month) are counted with np.bincount, anything else with value_counts.
+    Counts of several chunks can be summed with counts.add(other, fill_value=0).
+    """
+    values = pd.Series(values).dropna()
+    if pd.api.types.is_integer_dtype(values) and len(values) and 0 <= values.min() and values.max() < 2**16:
+        counts = np.bincount(values.to_numpy(dtype=np.int64))
+        present = np.flatnonzero(counts)
+        return pd.Series(counts[present], index=pd.Index(present, name=values.name), name='count')
+
+    return values.value_counts(sort=False).sort_index()
+
+def weighted_quantiles(counts: pd.Series, q) -> np.ndarray:
+    """
+    Quantiles of the raw values behind counts, with the linear interpolation of Series.quantile.
+    """
+    values = counts.index.to_numpy(dtype=float)
+    cumulative = np.cumsum(counts.to_numpy())
+    n = cumulative[-1]
+
+    # position of each quantile in the sorted raw values, and the values around it
+    position = (n - 1) * np.asarray(q, dtype=float)
+    lower = np.floor(position)
+    upper = np.minimum(lower + 1, n - 1)
+    lower_value = values[np.searchsorted(cumulative, lower, side='right')]
+    upper_value = values[np.searchsorted(cumulative, upper, side='right')]
+    return lower_value + (position - lower) * (upper_value - lower_value)
+
+def histogram_from_counts(counts: pd.Series, bins) -> tuple:
+    """
+    np.histogram of the raw values behind counts: (heights, edges), with the same edges as the raw data.
+    """
+    return np.histogram(counts.index.to_numpy(dtype=float), bins=bins, weights=counts.to_numpy())
+
+def kde_from_counts(counts: pd.Series, grid_size=200) -> tuple:
+    """
+    Gaussian KDE (Scott's rule) of the raw values behind counts, evaluated on a fixed grid over
+    their range. The cost depends on the number of distinct values, not on the number of rows.
+
+    Returns:
+        tuple: (grid, density) with the density integrating to 1.
+    """
+    values = counts.index.to_numpy(dtype=float)
+    weights = counts.to_numpy(dtype=float)
+    n = weights.sum()
+
+    mean = np.average(values, weights=weights)
+    std = np.sqrt(np.sum(weights * (values - mean) ** 2) / max(n - 1, 1))
+    bandwidth = std * n ** (-1 / 5)
+
+    grid = np.linspace(values.min(), values.max(), grid_size)
+    if bandwidth == 0:
+        return grid, np.zeros(grid_size)
+
+    z = (grid[:, None] - values[None, :]) / bandwidth
+    density = (np.exp(-0.5 * z ** 2) @ weights) / (n * bandwidth * np.sqrt(2 * np.pi))
+    return grid, density
+
+def _bin_of(edges: np.ndarray, value) -> int:
+
+    return int(np.clip(np.searchsorted(edges, value, side='right') - 1, 0, len(edges) - 2))
+
+def _counts_plot(ax, counts: pd.Series, bins, kde: bool) -> tuple:
+    """
+    Draw the histogram (and KDE scaled to it) of the raw values behind counts.
+    """
+    heights, edges = histogram_from_counts(counts, bins)
+    ax.bar(edges[:-1], heights, width=np.diff(edges), align='edge', alpha=0.75, edgecolor='white')
+
+    if kde and len(counts) > 1:
+        grid, density = kde_from_counts(counts)
+        ax.plot(grid, density * counts.sum() * np.diff(edges).mean())
+
+    return heights, edges
+
 # plot data                ----------------------------------------------------------------
-def top_n_payment_dates_plot(payment_schedule_backend_table, top_n=5):
-    
-    main_observations = list(
-        (
-            payment_schedule_backend_table["payment_date"]
-            .value_counts()
-            .nlargest(top_n)
-            .index.sort_values()
-        )
-    )
+def _plotting_libraries():
+    """
+    Import seaborn and matplotlib on first use, so importing this module stays cheap for headless runs.
+    """
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    return sns, plt
+
+def top_n_payment_dates_plot(payment_schedule_backend_table=None, top_n=5, counts=None, kde=True):
+    """
+    Distribution of payment dates, with the top_n days and the quartiles annotated.
+
+    Everything is computed from the count of each payment date, so pass counts
+    (value_counts_of(df['payment_date']), possibly summed over chunks) instead of the table
+    for large data. kde=False skips the density curve.
+    """
+    sns, plt = _plotting_libraries()
+
+    if counts is None:
+        counts = value_counts_of(payment_schedule_backend_table["payment_date"])
+
+    main_observations = list(counts.nlargest(top_n).index.sort_values())
 
     # Plot distribution
     plt.figure(figsize=(20, 5))
+    ax = plt.gca()
 
-    ax = sns.histplot(payment_schedule_backend_table["payment_date"], kde=True, bins=31)
+    heights, edges = _counts_plot(ax, counts, bins=31, kde=kde)
     sns.despine(top=True, right=True)
 
     # Ensure x-axis starts at 0
@@ -26,56 +116,55 @@ def top_n_payment_dates_plot(payment_schedule_backend_table, top_n=5):
 
     # Add centered annotations inside the bins for main observation days
     for date in main_observations:
-        for patch in ax.patches:
-            if patch.get_x() <= date < patch.get_x() + patch.get_width():
-                height = patch.get_height()
-                center_x = patch.get_x() + (patch.get_width() / 2)  # Center text in the bin
-                plt.text(center_x, 
-                         height - 50,  # Adjust vertical position slightly above the bin
-                         str(date), 
-                         ha="center",
-                         va="bottom", 
-                         fontsize=12, 
-                         color="black", 
-                         fontweight="bold")
+        i = _bin_of(edges, date)
+        center_x = (edges[i] + edges[i + 1]) / 2  # Center text in the bin
+        plt.text(center_x, 
+                 heights[i] - 50,  # Adjust vertical position slightly above the bin
+                 str(date), 
+                 ha="center",
+                 va="bottom", 
+                 fontsize=12, 
+                 color="black", 
+                 fontweight="bold")
 
     # Calculate quantiles
-    q25, q50, q75 = payment_schedule_backend_table["payment_date"].quantile([0.25, 0.5, 0.75])
+    q25, q50, q75 = weighted_quantiles(counts, [0.25, 0.5, 0.75])
 
     for quantile, label in zip([q25, q50, q75], ["25%", "50%", "75%"]):
-        for patch in ax.patches:
-            if patch.get_x() <= quantile < patch.get_x() + patch.get_width():
-                height = patch.get_height()
-                center_x = patch.get_x() + (patch.get_width() / 2)  # Center text in the bin
-                plt.text(center_x, 
-                         height + 1,  # Place slightly above the highest bin
-                         label, 
-                         ha="center", 
-                         fontsize=12, 
-                         color="black", 
-                         fontweight="bold")
+        i = _bin_of(edges, quantile)
+        center_x = (edges[i] + edges[i + 1]) / 2  # Center text in the bin
+        plt.text(center_x, 
+                 heights[i] + 1,  # Place slightly above the highest bin
+                 label, 
+                 ha="center", 
+                 fontsize=12, 
+                 color="black", 
+                 fontweight="bold")
 
     plt.xlabel("Payment Date")
     plt.ylabel("Frequency")
     plt.title("Distribution of Payment Dates")
     plt.show()
 
-def top_n_allowances_plot(allowance_events, top_n=5):
-    
-    main_observations = list(
-        (
-            allowance_events["allowance.amount"]
-            .value_counts()
-            .nlargest(top_n)
-            .index.sort_values()
-        )
-    )
+def top_n_allowances_plot(allowance_events=None, top_n=5, counts=None, kde=True):
+    """
+    Distribution of allowance amounts, with the top_n amounts and the quartiles annotated.
+
+    Everything is computed from the count of each amount, so pass counts
+    (value_counts_of(events['allowance.amount']), possibly summed over chunks) instead of
+    the events for large data. kde=False skips the density curve.
+    """
+    sns, plt = _plotting_libraries()
+
+    if counts is None:
+        counts = value_counts_of(allowance_events["allowance.amount"])
+
+    main_observations = list(counts.nlargest(top_n).index.sort_values())
 
     # Plot distribution
     plt.figure(figsize=(20, 5))
-    ax = sns.histplot(allowance_events["allowance.amount"], 
-                      kde=True, 
-                      bins=allowance_events["allowance.amount"].unique().size)
+    ax = plt.gca()
+    heights, edges = _counts_plot(ax, counts, bins=len(counts), kde=kde)
     
     # Remove top and right plot borders
     sns.despine(top=True, right=True)
@@ -89,7 +178,7 @@ def top_n_allowances_plot(allowance_events, top_n=5):
 
     # Add annotations inside the bins for main observation allowance amounts
     for idx, val in enumerate(main_observations):
-        max_bin_height = max([patch.get_height() for patch in ax.patches if patch.get_x() <= val < patch.get_x() + patch.get_width()], default=0)
+        max_bin_height = heights[_bin_of(edges, val)]
         plt.text(val + 1, 
                  max_bin_height + (y_max * 0.04),  # Offset text above the bin
                  f"{val:.0f}\nUSD", 
@@ -100,10 +189,10 @@ def top_n_allowances_plot(allowance_events, top_n=5):
                  fontweight="bold")
 
     # Calculate quantiles
-    q25, q50, q75 = allowance_events["allowance.amount"].quantile([0.25, 0.5, 0.75])
+    q25, q50, q75 = weighted_quantiles(counts, [0.25, 0.5, 0.75])
 
     for quantile, label in zip([q25, q50, q75], ["25%", "50%", "75%"]):
-        max_bin_height = max([patch.get_height() for patch in ax.patches if patch.get_x() <= quantile < patch.get_x() + patch.get_width()], default=0)
+        max_bin_height = heights[_bin_of(edges, quantile)]
         plt.text(quantile + 1, 
                  max_bin_height + 10, #- (y_max * 0.1),  # Offset text above the bin
                  label, 
@@ -117,6 +206,7 @@ def top_n_allowances_plot(allowance_events, top_n=5):
     plt.show()
 
 def plot_categorical_variables(allowance_events):
+    sns, plt = _plotting_libraries()
     fig, axes = plt.subplots(1, 2, figsize=(15, 5))
 
     # Frequency Plot
@@ -164,6 +254,7 @@ def plot_categorical_variables(allowance_events):
     plt.show()
 
 def plot_contingency_table(allowance_events):
+    sns, plt = _plotting_libraries()
     # Create the contingency table
     contingency_table = pd.crosstab(
         allowance_events["allowance.scheduled.day"], 
@@ -182,6 +273,7 @@ def plot_contingency_table(allowance_events):
     plt.show()
 
 def plot_frequency_and_errors(check_field_df):
+    sns, plt = _plotting_libraries()
     # Define order of frequencies
     frequency_order = ["biweekly", "weekly", "daily", "monthly"]
 
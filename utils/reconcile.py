@@ -0,0 +1,216 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.compare import CsvDiffSink, DiffSummary, compare_backend_dfs, write_backend_diffs
+from utils.instrument import instrumented
+from utils.load_n_transform import iter_allowance_backend_table, iter_allowance_events, iter_payment_schedule_backend_table
+from utils.payment_schedule import (
+    LatestEvents,
+    apply_allowance_state,
+    generate_payment_schedule_backend_table,
+    get_allowance_state,
+    get_latest_events,
+    update_allowance_backend_table
+)
+
+DIFF_REPORT_COLUMNS = ['table', 'uuid', 'column', 'original', 'updated']
+
+
+# reconcile backend tables ----------------------------------------------------------------
+@instrumented('reconcile.reconcile')
+def reconcile(allowance_backend_df: pd.DataFrame, payment_schedule_df: pd.DataFrame, allowance_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Run the whole reconciliation for a set of users: update the allowance backend table from the
+    events, generate the expected payment schedule and compare both against the backend tables.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): The allowance backend table (get_allowance_backend_table).
+        payment_schedule_df (pd.DataFrame): The payment schedule backend table (get_payment_schedule_backend_table).
+        allowance_events (pd.DataFrame): The allowance events (get_allowance_events); left unmodified.
+
+    Returns:
+        pd.DataFrame: The differences with columns 'table', 'uuid', 'column', 'original', 'updated',
+                    ordered by table and uuid.
+    """
+    allowance_backend_df_updated = update_allowance_backend_table(allowance_backend_df, allowance_events.copy())
+    payment_schedule_df_updated = generate_payment_schedule_backend_table(allowance_backend_df_updated)
+
+    allowance_diff = compare_backend_dfs(
+        allowance_backend_df_updated.set_index('uuid'),
+        allowance_backend_df.set_index('uuid')
+    )
+    schedule_diff = compare_backend_dfs(
+        payment_schedule_df_updated.set_index('uuid'),
+        payment_schedule_df.set_index('uuid')
+    )
+
+    allowance_diff.insert(0, 'table', 'allowance_backend_table')
+    schedule_diff.insert(0, 'table', 'payment_schedule_backend_table')
+
+    # An empty table diff is left out of the concat so that it does not change the dtypes.
+    diffs = [diff for diff in (allowance_diff, schedule_diff) if len(diff)] or [allowance_diff]
+    return pd.concat(diffs, ignore_index=True)
+
+def _shard_ids(uuids: pd.Series, n_shards: int) -> np.ndarray:
+    """
+    Stable hash partition of uuids into n_shards, identical across processes and runs.
+    """
+    return (pd.util.hash_pandas_object(uuids, index=False).to_numpy() % n_shards).astype(np.int64)
+
+def partition_by_uuid(df: pd.DataFrame, key: str, n_shards: int) -> list:
+    """
+    Split df into n_shards frames by hashing its key column, keeping the row order inside each shard.
+    """
+    shard = _shard_ids(df[key], n_shards)
+    order = np.argsort(shard, kind='stable')
+    bounds = np.searchsorted(shard[order], np.arange(n_shards + 1))
+    return [df.iloc[order[bounds[i]:bounds[i + 1]]] for i in range(n_shards)]
+
+@instrumented('reconcile.reconcile_sharded')
+def reconcile_sharded(allowance_backend_df: pd.DataFrame, payment_schedule_df: pd.DataFrame, allowance_events: pd.DataFrame,
+                      n_shards=None, max_workers=None) -> pd.DataFrame:
+    """
+    Sharded version of reconcile.
+
+    Reconciliation is independent per user, so the events and both backend tables are
+    hash-partitioned by uuid, each shard is reconciled in a process pool and the diffs are merged.
+    The result is the same as reconcile on the whole tables.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): The allowance backend table.
+        payment_schedule_df (pd.DataFrame): The payment schedule backend table.
+        allowance_events (pd.DataFrame): The allowance events.
+        n_shards (int): Number of uuid partitions. Defaults to the number of workers.
+        max_workers (int): Number of worker processes. Defaults to os.cpu_count(); 1 runs every shard in-process.
+
+    Returns:
+        pd.DataFrame: The merged differences, as returned by reconcile.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    n_shards = n_shards or max_workers
+
+    shards = zip(
+        partition_by_uuid(allowance_backend_df, 'uuid', n_shards),
+        partition_by_uuid(payment_schedule_df, 'uuid', n_shards),
+        partition_by_uuid(allowance_events, 'user.id', n_shards)
+    )
+
+    if max_workers == 1:
+        diffs = [reconcile(*shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            diffs = list(executor.map(reconcile, *zip(*shards)))
+
+    # Shards without differences are left out of the concat (their empty columns would change the dtypes).
+    diffs = [diff for diff in diffs if len(diff)]
+    if not diffs:
+        return pd.DataFrame(columns=DIFF_REPORT_COLUMNS)
+
+    # Each shard is ordered by table and uuid; a stable sort restores the global order.
+    diff_df = pd.concat(diffs, ignore_index=True)
+    diff_df = diff_df.sort_values(['table', 'uuid'], kind='stable').reset_index(drop=True)
+    return diff_df[DIFF_REPORT_COLUMNS]
+
+# out-of-core reconciliation ---------------------------------------------------------------
+@instrumented('reconcile.build_allowance_state')
+def build_allowance_state(events_path: str, chunksize=100_000) -> pd.DataFrame:
+    """
+    Latest state of every user (frequency, day, next_payment_day, updated_at), indexed by uuid,
+    folded chunk by chunk from the events file (LatestEvents): only one chunk of events and one
+    row per user are held at a time. frequency and day are categoricals to keep the map small.
+    """
+    latest = LatestEvents()
+    for events in iter_allowance_events(events_path, chunksize=chunksize):
+        latest.update(get_latest_events(events)[
+            ['event.timestamp', 'allowance.scheduled.frequency', 'allowance.scheduled.day', 'updated_at']
+        ])
+
+    if not len(latest):
+        return pd.DataFrame(columns=['frequency', 'day', 'next_payment_day', 'updated_at'])
+
+    state = get_allowance_state(latest.to_frame())
+    state['frequency'] = state['frequency'].astype('category')
+    state['day'] = state['day'].astype('category')
+    return state
+
+@instrumented('reconcile.reconcile_out_of_core')
+def reconcile_out_of_core(allowance_backend_path: str, payment_schedule_path: str, allowance_events_path: str,
+                          output_path: str, chunksize=100_000) -> dict:
+    """
+    Out-of-core version of reconcile for backend tables that do not fit in memory.
+
+    The events are folded into a compact latest-state-per-user map first. The allowance backend
+    CSV is then read chunk by chunk: each chunk is updated from the map and compared with itself,
+    and the payment_date expected for its enabled rows is kept (uuid and day only). Finally the
+    payment schedule CSV is read chunk by chunk and compared with the expected rows of its uuids;
+    expected rows never seen in the schedule are reported last. Diff rows are streamed to
+    output_path (write_backend_diffs) as they are found.
+
+    Peak memory is O(users), not bounded by chunksize: the state map (one row per user with
+    events), the expected schedule (uuid, payment_date and frequency of every enabled backend
+    row) and a seen flag per expected row are held for the whole run. Only the table rows,
+    events and differences are limited to one chunk at a time.
+
+    The differences are the same as reconcile's (with the backend table in file order instead
+    of creation_date order); a uuid repeated in different chunks of the allowance backend table
+    is compared row by row rather than with every copy.
+
+    Args:
+        allowance_backend_path (str): Path to the allowance backend table CSV.
+        payment_schedule_path (str): Path to the payment schedule backend table CSV.
+        allowance_events_path (str): Path to the allowance events (JSON array or JSON lines).
+        output_path (str): CSV file the differences are written to, with the columns of reconcile.
+        chunksize (int): Rows (and events) read at a time.
+
+    Returns:
+        dict: The DiffSummary (counts per column and per frequency) of each table.
+    """
+    state = build_allowance_state(allowance_events_path, chunksize=chunksize)
+    sink = CsvDiffSink(output_path, columns=DIFF_REPORT_COLUMNS)
+    summaries = {'allowance_backend_table': DiffSummary(), 'payment_schedule_backend_table': DiffSummary()}
+
+    expected_chunks = []
+    for allowance_backend_df in iter_allowance_backend_table(allowance_backend_path, chunksize=chunksize):
+        allowance_backend_df_updated = apply_allowance_state(allowance_backend_df, state)
+        write_backend_diffs(
+            allowance_backend_df_updated.set_index('uuid'),
+            allowance_backend_df.set_index('uuid'),
+            sink,
+            frequencies=allowance_backend_df_updated.set_index('uuid')['frequency'],
+            table='allowance_backend_table',
+            summary=summaries['allowance_backend_table']
+        )
+        expected_chunk = generate_payment_schedule_backend_table(allowance_backend_df_updated)
+        expected_chunk['frequency'] = allowance_backend_df_updated.loc[
+            allowance_backend_df_updated['status'] == "enabled", 'frequency'
+        ].astype('category').to_numpy()
+        expected_chunks.append(expected_chunk)
+
+    expected = pd.concat(expected_chunks, ignore_index=True) if expected_chunks else pd.DataFrame(columns=['uuid', 'payment_date', 'frequency'])
+    expected_index = pd.Index(expected['uuid'])
+    frequencies = expected.set_index('uuid')['frequency']
+    seen = np.zeros(len(expected), dtype=bool)
+
+    def write_schedule_diffs(expected_rows: pd.DataFrame, payment_schedule_df: pd.DataFrame):
+        write_backend_diffs(
+            expected_rows.set_index('uuid'),
+            payment_schedule_df.set_index('uuid'),
+            sink,
+            frequencies=frequencies,
+            table='payment_schedule_backend_table',
+            summary=summaries['payment_schedule_backend_table']
+        )
+
+    for payment_schedule_df in iter_payment_schedule_backend_table(payment_schedule_path, chunksize=chunksize):
+        # expected rows of the uuids in this chunk, each once (duplicates pair up in the merge)
+        positions, _ = expected_index.get_indexer_non_unique(payment_schedule_df['uuid'])
+        positions = np.unique(positions[positions >= 0])
+        seen[positions] = True
+        write_schedule_diffs(expected.iloc[positions], payment_schedule_df)
+
+    # enabled allowances without any schedule row
+    write_schedule_diffs(expected[~seen], expected.iloc[:0])
+
+    return summaries
@@ -0,0 +1,169 @@
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from utils.instrument import instrumented
+from utils.load_n_transform import get_allowance_backend_table, iter_allowance_events, iter_payment_schedule_backend_table
+from utils.reconcile import reconcile
+
+STRATA = ['frequency', 'status']
+
+TABLES = ['allowance_backend_table', 'payment_schedule_backend_table']
+
+ESTIMATE_COLUMNS = ['table', 'frequency', 'population', 'sampled', 'mismatches', 'rate', 'ci_low', 'ci_high']
+
+
+# sampling estimates       ----------------------------------------------------------------
+def wilson_interval(rate, n, confidence=0.95) -> tuple:
+    """
+    Wilson score interval of a proportion observed (or estimated) as rate over n trials.
+    Works element-wise on arrays; n may be an effective sample size.
+    """
+    rate = np.asarray(rate, dtype=float)
+    n = np.asarray(n, dtype=float)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = 1 + z**2 / n
+        center = (rate + z**2 / (2 * n)) / denominator
+        half_width = z * np.sqrt(rate * (1 - rate) / n + z**2 / (4 * n**2)) / denominator
+
+    return np.clip(center - half_width, 0, 1), np.clip(center + half_width, 0, 1)
+
+def stratified_sample(allowance_backend_df: pd.DataFrame, sample_size=2_000, strata=STRATA, min_per_stratum=30, seed=0) -> pd.DataFrame:
+    """
+    Sample backend rows without replacement within each stratum (frequency x status by default).
+
+    The sample is allocated proportionally to the stratum sizes, with at least min_per_stratum
+    rows (or the whole stratum when smaller) so that rare frequencies still get an estimate.
+
+    Returns:
+        pd.DataFrame: The sampled rows of allowance_backend_df.
+    """
+    keys = allowance_backend_df[strata].astype(object).fillna('unknown')
+    population = keys.groupby(strata).size()
+
+    allocation = np.maximum(np.round(population * sample_size / population.sum()), min_per_stratum)
+    allocation = np.minimum(allocation, population).astype(np.int64)
+
+    # A random rank within each stratum keeps the first allocation[stratum] rows.
+    rng = np.random.default_rng(seed)
+    rank = keys.assign(_key=rng.random(len(keys))).groupby(strata)['_key'].rank(method='first')
+    quota = pd.MultiIndex.from_frame(keys).map(allocation) if len(strata) > 1 else keys[strata[0]].map(allocation)
+
+    return allowance_backend_df[rank.to_numpy() <= np.asarray(quota, dtype=float)]
+
+def _mismatch_estimates(allowance_backend_df: pd.DataFrame, sample_df: pd.DataFrame, diff_df: pd.DataFrame,
+                        strata: list, confidence: float) -> pd.DataFrame:
+    """
+    Stratified estimate of the share of users with a difference in each table, per frequency and overall.
+    """
+    population = allowance_backend_df[strata].astype(object).fillna('unknown').groupby(strata).size().rename('population')
+
+    sample = sample_df[['uuid'] + strata].astype(object).fillna('unknown')
+    estimates = []
+    for table in TABLES:
+        mismatched = diff_df.loc[diff_df['table'] == table, 'uuid'].unique()
+        sample['mismatch'] = sample['uuid'].isin(mismatched)
+
+        per_stratum = sample.groupby(strata)['mismatch'].agg(['size', 'sum']).join(population)
+        per_stratum['rate'] = per_stratum['sum'] / per_stratum['size']
+        # variance of the stratum rate, with the finite population correction
+        per_stratum['variance'] = (
+            per_stratum['rate'] * (1 - per_stratum['rate']) / np.maximum(per_stratum['size'] - 1, 1)
+            * (1 - per_stratum['size'] / per_stratum['population'])
+        )
+
+        groups = list(per_stratum.groupby(level='frequency')) + [('all', per_stratum)]
+        for frequency, rows in groups:
+            weights = rows['population'] / rows['population'].sum()
+            rate = float((weights * rows['rate']).sum())
+            variance = float((weights**2 * rows['variance']).sum())
+            sampled = int(rows['size'].sum())
+
+            # Wilson interval on the effective sample size of the stratified estimate; a census is exact
+            if sampled >= rows['population'].sum():
+                ci_low = ci_high = rate
+            else:
+                n_eff = rate * (1 - rate) / variance if variance > 0 else sampled
+                ci_low, ci_high = (float(bound) for bound in wilson_interval(rate, n_eff, confidence))
+
+            estimates.append({
+                'table': table,
+                'frequency': frequency,
+                'population': int(rows['population'].sum()),
+                'sampled': sampled,
+                'mismatches': int(rows['sum'].sum()),
+                'rate': rate,
+                'ci_low': ci_low,
+                'ci_high': ci_high
+            })
+
+    return pd.DataFrame(estimates, columns=ESTIMATE_COLUMNS)
+
+@instrumented('sampling.estimate_mismatch_rates')
+def estimate_mismatch_rates(allowance_backend_df: pd.DataFrame, payment_schedule_df: pd.DataFrame, allowance_events: pd.DataFrame,
+                            sample_size=2_000, strata=STRATA, min_per_stratum=30, confidence=0.95, seed=0) -> pd.DataFrame:
+    """
+    Quick health check: estimate the share of users with a difference in each backend table,
+    per frequency, from a stratified sample of uuids instead of the full reconciliation.
+
+    Only the sampled users' backend rows, schedule rows and events are reconciled. Rates are
+    combined over the strata with the population weights, and the confidence interval is the
+    Wilson interval on the effective sample size of that stratified estimate. Schedule rows
+    of uuids that are not in the allowance backend table cannot be sampled and are not counted.
+
+    Args:
+        allowance_backend_df (pd.DataFrame): The allowance backend table.
+        payment_schedule_df (pd.DataFrame): The payment schedule backend table.
+        allowance_events (pd.DataFrame): The allowance events; left unmodified.
+        sample_size (int): Approximate number of sampled uuids.
+        strata (list): Backend columns defining the strata; must include 'frequency'.
+        min_per_stratum (int): Minimum sample of each stratum.
+        confidence (float): Confidence level of the intervals.
+        seed (int): Seed of the sample.
+
+    Returns:
+        pd.DataFrame: One row per table and frequency (plus 'all') with columns 'table', 'frequency',
+                    'population', 'sampled', 'mismatches', 'rate', 'ci_low', 'ci_high'.
+    """
+    sample_df = stratified_sample(allowance_backend_df, sample_size, strata, min_per_stratum, seed)
+    uuids = pd.Index(sample_df['uuid'].unique())
+
+    diff_df = reconcile(
+        sample_df,
+        payment_schedule_df[payment_schedule_df['uuid'].isin(uuids)],
+        allowance_events[allowance_events['user.id'].isin(uuids)]
+    )
+    return _mismatch_estimates(allowance_backend_df, sample_df, diff_df, strata, confidence)
+
+@instrumented('sampling.estimate_mismatch_rates_from_files')
+def estimate_mismatch_rates_from_files(allowance_backend_path: str, payment_schedule_path: str, allowance_events_path: str,
+                                       sample_size=2_000, strata=STRATA, min_per_stratum=30, confidence=0.95, seed=0,
+                                       chunksize=100_000, cache=False) -> pd.DataFrame:
+    """
+    estimate_mismatch_rates reading the sources directly: the allowance backend table is loaded
+    to draw the sample, then the events and the payment schedule are streamed in chunks and only
+    the sampled users' rows are kept, so memory depends on the sample rather than the inputs.
+    """
+    allowance_backend_df = get_allowance_backend_table(allowance_backend_path, cache=cache)
+    sample_df = stratified_sample(allowance_backend_df, sample_size, strata, min_per_stratum, seed)
+    if sample_df.empty:
+        return pd.DataFrame(columns=ESTIMATE_COLUMNS)
+    uuids = pd.Index(sample_df['uuid'].unique())
+
+    allowance_events = [
+        events[events['user.id'].isin(uuids)]
+        for events in iter_allowance_events(allowance_events_path, chunksize=chunksize)
+    ]
+    payment_schedule = [
+        schedule[schedule['uuid'].isin(uuids)]
+        for schedule in iter_payment_schedule_backend_table(payment_schedule_path, chunksize=chunksize)
+    ]
+    # empty source files yield no chunk at all
+    if not allowance_events or not payment_schedule:
+        return pd.DataFrame(columns=ESTIMATE_COLUMNS)
+
+    diff_df = reconcile(sample_df, pd.concat(payment_schedule), pd.concat(allowance_events))
+    return _mismatch_estimates(allowance_backend_df, sample_df, diff_df, strata, confidence)
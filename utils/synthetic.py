@@ -0,0 +1,237 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, time
+
+from utils.payment_schedule import CURRENT_DATE, get_next_payment_dates, normalize_scheduled_days
+
+# (frequency, day) settings and their weights, roughly following the bundled dataset.
+SCHEDULES = [
+    ("weekly", "friday", 0.164), ("weekly", "monday", 0.061), ("weekly", "sunday", 0.055),
+    ("weekly", "saturday", 0.047), ("weekly", "thursday", 0.035), ("weekly", "wednesday", 0.026),
+    ("weekly", "tuesday", 0.019),
+    ("biweekly", "friday", 0.141), ("biweekly", "monday", 0.085), ("biweekly", "thursday", 0.045),
+    ("biweekly", "wednesday", 0.03), ("biweekly", "saturday", 0.024), ("biweekly", "sunday", 0.018),
+    ("biweekly", "tuesday", 0.013),
+    ("monthly", "first_day", 0.118), ("monthly", "fifteenth_day", 0.068),
+    ("daily", "daily", 0.051),
+]
+
+AMOUNTS = [(1, 0.06), (2, 0.02), (3, 0.02), (5, 0.27), (10, 0.21), (15, 0.04), (20, 0.21),
+           (25, 0.03), (30, 0.02), (40, 0.02), (50, 0.1)]
+
+START_DATE = datetime(2024, 7, 25)
+
+
+# generate synthetic data  ----------------------------------------------------------------
+def _uuids(rng: np.random.Generator, n: int) -> np.ndarray:
+    """
+    Random version 4 uuid strings drawn from rng, so datasets are reproducible from the seed.
+    """
+    raw = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hexes = [row.tobytes().hex() for row in raw]
+    return np.array([f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}" for h in hexes], dtype=object)
+
+def _choice(rng: np.random.Generator, options: list, size: int) -> np.ndarray:
+
+    weights = np.array([option[-1] for option in options], dtype=float)
+    return rng.choice(len(options), size=size, p=weights / weights.sum())
+
+def _format_event_timestamps(rng: np.random.Generator, timestamps: pd.Series, epoch_share: float) -> np.ndarray:
+    """
+    Events mostly use "YYYY-MM-DD H:MM:SS" strings; a share are digit-only Unix epochs.
+    """
+    formatted = (
+        timestamps.dt.strftime('%Y-%m-%d ') + timestamps.dt.hour.astype(str) + timestamps.dt.strftime(':%M:%S')
+    ).to_numpy(dtype=object)
+
+    is_epoch = rng.random(len(timestamps)) < epoch_share
+    formatted[is_epoch] = (timestamps[is_epoch].astype('int64') // 10**9).astype(str).to_numpy(dtype=object)
+    return formatted
+
+def _format_backend_timestamps(rng: np.random.Generator, timestamps: pd.Series, epoch_share: float) -> np.ndarray:
+    """
+    Backend updated_at mixes digit-only Unix epochs and ISO strings with nanoseconds and a "Z" suffix.
+    """
+    nanoseconds = pd.Series(rng.integers(0, 10**9, size=len(timestamps)), index=timestamps.index)
+    formatted = (
+        timestamps.dt.strftime('%Y-%m-%dT%H:%M:%S.') + nanoseconds.astype(str).str.zfill(9) + 'Z'
+    ).to_numpy(dtype=object)
+
+    is_epoch = rng.random(len(timestamps)) < epoch_share
+    formatted[is_epoch] = (timestamps[is_epoch].astype('int64') // 10**9).astype(str).to_numpy(dtype=object)
+    return formatted
+
+def generate_synthetic_dataset(n_users: int, seed=0, error_rate=0.3, enabled_share=0.73, epoch_share=0.22,
+                               current_date=CURRENT_DATE) -> tuple:
+    """
+    Generate a seeded synthetic dataset with the schemas of the bundled data.
+
+    Every user gets one allowance.created event followed by a geometric number of
+    allowance.edited events, over all four frequencies and with mixed epoch/ISO timestamps.
+    The backend tables are derived from the latest event of each user, then a share of rows
+    is corrupted the way the real backend is: wrong next_payment_day (mostly weekly/biweekly),
+    daily rows not updated on current_date, stale frequency/day from an earlier event, and
+    payment schedule rows that are wrong or missing.
+
+    Args:
+        n_users (int): Number of users (allowances).
+        seed (int): Seed of the random generator; the same seed gives the same dataset.
+        error_rate (float): Base share of backend rows with an injected inconsistency.
+        enabled_share (float): Share of enabled allowances.
+        epoch_share (float): Share of timestamps written as Unix epochs.
+        current_date (date): The as-of date of the backend tables.
+
+    Returns:
+        tuple: (allowance_backend_table, payment_schedule_backend_table, allowance_events) as raw
+               DataFrames in the on-disk layout (flattened event columns, user_id schedule key).
+    """
+    rng = np.random.default_rng(seed)
+    uuids = _uuids(rng, n_users)
+
+    # events: one creation plus a geometric number of edits per user
+    n_events = rng.geometric(0.55, size=n_users)
+    user_pos = np.repeat(np.arange(n_users), n_events)
+    first_event = np.r_[0, np.cumsum(n_events)[:-1]]
+    is_created = np.zeros(len(user_pos), dtype=bool)
+    is_created[first_event] = True
+
+    end = datetime.combine(current_date, time(6))
+    span = int((end - START_DATE).total_seconds())
+    created_at = rng.integers(0, span, size=n_users)
+    # later events fall between the creation and the end of the window, in order
+    offsets = rng.integers(0, span, size=len(user_pos)) % (span - created_at[user_pos])
+    offsets[is_created] = 0
+    order = np.lexsort((offsets, user_pos))
+    seconds = created_at[user_pos] + offsets[order]
+    timestamps = pd.Series(pd.Timestamp(START_DATE) + pd.to_timedelta(seconds, unit='s'))
+
+    schedule = _choice(rng, SCHEDULES, len(user_pos))
+    amount = _choice(rng, AMOUNTS, len(user_pos))
+    # edits keep the schedule of the previous event half of the time
+    keep = ~is_created & (rng.random(len(user_pos)) < 0.5)
+    for _ in range(int(n_events.max())):
+        previous = np.r_[schedule[0], schedule[:-1]]
+        if not (keep & (schedule != previous)).any():
+            break
+        schedule = np.where(keep, previous, schedule)
+
+    frequency = np.array([SCHEDULES[i][0] for i in range(len(SCHEDULES))], dtype=object)[schedule]
+    day = np.array([SCHEDULES[i][1] for i in range(len(SCHEDULES))], dtype=object)[schedule]
+
+    allowance_events = pd.DataFrame({
+        'user.id': uuids[user_pos],
+        'event.timestamp': _format_event_timestamps(rng, timestamps, epoch_share),
+        'event.name': np.where(is_created, 'allowance.created', 'allowance.edited'),
+        'allowance.scheduled.frequency': frequency,
+        'allowance.scheduled.day': day,
+        'allowance.amount': np.array([a[0] for a in AMOUNTS])[amount]
+    })
+
+    # backend: the correct state from the latest event of each user
+    last_event = np.r_[first_event[1:], len(user_pos)] - 1
+    backend_frequency = frequency[last_event]
+    backend_day = day[last_event]
+    expected = get_next_payment_dates(
+        backend_frequency, normalize_scheduled_days(backend_frequency, backend_day), current_date
+    )
+    next_payment_day = pd.Series(expected).dt.day.to_numpy(dtype=np.int64)
+
+    # inject inconsistencies, concentrated on weekly and biweekly like the real backend
+    frequency_weight = pd.Series(backend_frequency).map(
+        {'biweekly': 1.5, 'weekly': 1.2, 'daily': 1.0, 'monthly': 0.05}
+    ).to_numpy()
+    corrupted = rng.random(n_users) < error_rate * frequency_weight
+    kind = rng.integers(0, 3, size=n_users)
+
+    wrong_day = corrupted & (kind == 0)
+    next_payment_day[wrong_day] = rng.integers(1, 29, size=wrong_day.sum())
+
+    not_updated = corrupted & (kind == 1) & (backend_frequency == 'daily')
+    next_payment_day[not_updated] = current_date.day
+
+    stale = corrupted & (kind == 2) & (n_events > 1)
+    backend_frequency = backend_frequency.copy()
+    backend_day = backend_day.copy()
+    backend_frequency[stale] = frequency[last_event[stale] - 1]
+    backend_day[stale] = day[last_event[stale] - 1]
+
+    status = np.where(rng.random(n_users) < enabled_share, 'enabled', 'disabled')
+    updated_at = timestamps.iloc[last_event].reset_index(drop=True)
+
+    allowance_backend_table = pd.DataFrame({
+        'uuid': uuids,
+        'creation_date': (timestamps.iloc[first_event].astype('int64') // 10**9).to_numpy(),
+        'frequency': backend_frequency,
+        'day': backend_day,
+        'updated_at': _format_backend_timestamps(rng, updated_at, epoch_share),
+        'next_payment_day': next_payment_day,
+        'status': status
+    })
+
+    # payment schedule: one row per enabled allowance, some wrong and some missing
+    enabled = np.flatnonzero(status == 'enabled')
+    payment_date = next_payment_day[enabled].copy()
+    wrong_payment = rng.random(len(enabled)) < error_rate / 3
+    payment_date[wrong_payment] = rng.integers(1, 29, size=wrong_payment.sum())
+    kept = rng.random(len(enabled)) >= error_rate / 30
+
+    payment_schedule_backend_table = pd.DataFrame({
+        'user_id': uuids[enabled][kept],
+        'payment_date': payment_date[kept]
+    })
+
+    return allowance_backend_table, payment_schedule_backend_table, allowance_events
+
+def _event_record(row) -> dict:
+
+    return {
+        "user": {"id": row[0]},
+        "event": {"timestamp": row[1], "name": row[2]},
+        "allowance": {"scheduled": {"frequency": row[3], "day": row[4]}, "amount": int(row[5])}
+    }
+
+def write_allowance_events(allowance_events: pd.DataFrame, path: str, lines=False):
+    """
+    Write flattened events back to the nested JSON layout, as a JSON array or as newline-delimited JSON.
+    """
+    with open(path, 'w') as f:
+        if not lines:
+            f.write('[\n')
+
+        for i, row in enumerate(allowance_events.itertuples(index=False, name=None)):
+            record = json.dumps(_event_record(row))
+            if lines:
+                f.write(record + '\n')
+            else:
+                f.write(('    ' if i == 0 else ',\n    ') + record)
+
+        if not lines:
+            f.write('\n]\n')
+
+def write_synthetic_dataset(out_dir: str, n_users: int, seed=0, lines=False, **kwargs) -> dict:
+    """
+    Generate a synthetic dataset and write it with the file names of the data folder.
+
+    Returns:
+        dict: Paths of the 'allowance_backend_table', 'payment_schedule_backend_table' and 'allowance_events' files.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    allowance_backend_table, payment_schedule_backend_table, allowance_events = generate_synthetic_dataset(
+        n_users, seed=seed, **kwargs
+    )
+
+    paths = {
+        'allowance_backend_table': os.path.join(out_dir, 'allowance_backend_table.csv'),
+        'payment_schedule_backend_table': os.path.join(out_dir, 'payment_schedule_backend_table.csv'),
+        'allowance_events': os.path.join(out_dir, 'allowance_events.jsonl' if lines else 'allowance_events.json'),
+    }
+
+    allowance_backend_table.to_csv(paths['allowance_backend_table'], index=False)
+    payment_schedule_backend_table.to_csv(paths['payment_schedule_backend_table'], index=False)
+    write_allowance_events(allowance_events, paths['allowance_events'], lines=lines)
+
+    return paths